@@ -0,0 +1,146 @@
+"""
+Stand-ins for the salt clients the exporter talks to, backed by a synthetic
+fleet. Install them with ``override_clients(**FakeMaster(...).clients())``.
+"""
+import time
+import random
+from datetime import datetime
+
+FUNCTIONS = ('state.apply', 'state.highstate', 'test.ping', 'cmd.run', 'saltutil.sync_all', 'runner.jobs.active')
+
+
+class FakeFleet:
+    def __init__(self, minions: int, jobs_per_day: int, states: int = 20, down_ratio: float = 0.02,
+                 active_jobs: int = 5, seed: int = 0):
+        rnd = random.Random(seed)
+        self.states = states
+        self.minions = [f'minion-{i:06d}.example.com' for i in range(minions)]
+        self.down = set(rnd.sample(self.minions, int(minions * down_ratio)))
+        self.jobs = {}
+        day_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        elapsed = max(1.0, (datetime.now() - day_start).total_seconds())
+        for i in range(jobs_per_day):
+            moment = day_start.timestamp() + elapsed * i / max(1, jobs_per_day)
+            jid = datetime.fromtimestamp(moment).strftime('%Y%m%d%H%M%S') + f'{i % 1000000:06d}'
+            if rnd.random() < 0.9:
+                target, tgt_type = rnd.choice(self.minions), 'glob'
+            else:
+                target, tgt_type = rnd.sample(self.minions, min(minions, 20)), 'list'
+            self.jobs[jid] = {'fun': rnd.choice(FUNCTIONS), 'tgt': target, 'tgt_type': tgt_type, 'arg': [], 'user': 'root'}
+        self.active = dict(list(self.jobs.items())[-active_jobs:]) if active_jobs else {}
+
+    def targets(self, jid: str):
+        tgt = self.jobs[jid]['tgt']
+        return tgt if isinstance(tgt, list) else [tgt]
+
+    def job_return(self, jid: str, minion: str):
+        # State return of `states` entries, like a highstate.
+        # Failed returns (retcode 2) have their first state failed.
+        rnd = random.Random(f'{jid}{minion}')
+        retcode = 0 if rnd.random() > 0.05 else 2
+        return {
+            'return': {
+                f'file_|-state_{i}_|-/etc/state_{i}_|-managed': {
+                    'result': bool(i or not retcode), 'changes': {}, 'comment': 'File is in the correct state',
+                    'duration': rnd.uniform(1, 500), '__run_num__': i
+                }
+                for i in range(self.states)
+            },
+            'retcode': retcode
+        }
+
+
+class FakeLocalClient:
+    def __init__(self, fleet: FakeFleet, latency: float):
+        self.fleet = fleet
+        self.latency = latency
+
+    def cmd_iter_no_block(self, tgt, fun, tgt_type='glob', expect_minions=False, **kwargs):
+        # Published jobs land in the job cache like on a real master, with
+        # the keyword arguments (metadata among them) in their load.
+        minions = self.fleet.minions if tgt_type == 'glob' else tgt
+        jid = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        self.fleet.jobs[jid] = {'fun': fun, 'tgt': list(minions), 'tgt_type': 'list', 'arg': [], 'user': 'root', 'kwargs': kwargs}
+        yield None
+        time.sleep(self.latency)
+        for minion in minions:
+            if minion in self.fleet.down:
+                yield {minion: {'failed': True}}
+            else:
+                yield {minion: {'ret': '3006.9' if fun == 'test.version' else True, 'retcode': 0}}
+
+
+class FakeRunner:
+    def __init__(self, fleet: FakeFleet, latency: float):
+        self.fleet = fleet
+        self.latency = latency
+
+    def cmd(self, fun, *args, **kwargs):
+        time.sleep(self.latency)
+        if fun == 'jobs.active':
+            return {
+                jid: {'Function': job['fun'], 'Target': job['tgt'], 'Running': [{m: 1} for m in self.fleet.targets(jid)]}
+                for jid, job in self.fleet.active.items()
+            }
+        return {}
+
+
+class FakeKey:
+    def __init__(self, fleet: FakeFleet, latency: float):
+        self.fleet = fleet
+        self.latency = latency
+
+    def list_keys(self):
+        time.sleep(self.latency)
+        return {'minions': list(self.fleet.minions), 'minions_pre': [], 'minions_denied': [], 'minions_rejected': []}
+
+
+class FakeReturners(dict):
+    # Loader-like mapping of `local_cache.*` job cache calls.
+    def __init__(self, fleet: FakeFleet, latency: float):
+        super().__init__()
+        self.fleet = fleet
+        self.latency = latency
+        self.calls = 0
+        self.update({
+            'local_cache.get_jids': self.get_jids,
+            'local_cache.get_load': self.get_load,
+            'local_cache.get_jid': self.get_jid,
+        })
+
+    def _call(self):
+        self.calls += 1
+        time.sleep(self.latency)
+
+    def get_jids(self):
+        self._call()
+        ret = {}
+        for jid, job in self.fleet.jobs.items():
+            ret[jid] = {'Function': job['fun'], 'Arguments': [], 'Target': job['tgt'], 'Target-type': job['tgt_type'], 'User': 'root'}
+            if 'metadata' in job.get('kwargs', {}):
+                ret[jid]['Metadata'] = job['kwargs']['metadata']
+        return ret
+
+    def get_load(self, jid):
+        self._call()
+        job = self.fleet.jobs.get(str(jid), {})
+        return dict(job, Minions=self.fleet.targets(str(jid))) if job else {}
+
+    def get_jid(self, jid):
+        self._call()
+        jid = str(jid)
+        if jid not in self.fleet.jobs:
+            return {}
+        return {minion: self.fleet.job_return(jid, minion) for minion in self.fleet.targets(jid) if minion not in self.fleet.down}
+
+
+class FakeMaster:
+    def __init__(self, fleet: FakeFleet, latency: float = 0.0):
+        self.fleet = fleet
+        self.local_client = FakeLocalClient(fleet, latency)
+        self.runner = FakeRunner(fleet, latency)
+        self.key = FakeKey(fleet, latency)
+        self.returners = FakeReturners(fleet, latency)
+
+    def clients(self):
+        return {'runner': self.runner, 'key': self.key, 'returners': self.returners, 'local_client': self.local_client}
@@ -0,0 +1,105 @@
+"""
+SQLite stand-in for a database-backed master_job_cache (mysql, postgres).
+
+Works as a Salt returner (drop it into extension_modules/returners and set
+``master_job_cache: sqlite_cache`` and ``sqlite_cache.database``) and as a
+plain module for offline benchmarks, where ``__opts__`` is set directly.
+Besides the standard job cache calls it offers ``get_jids_since``, the
+time-bounded listing the exporter prefers. ``ROWS_FETCHED`` counts rows read
+from the database, standing in for what would cross the wire.
+"""
+import json
+import sqlite3
+import threading
+import salt.utils.jid
+
+__virtualname__ = 'sqlite_cache'
+__opts__ = {}
+
+ROWS_FETCHED = 0
+_local = threading.local()
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jids (jid TEXT PRIMARY KEY, load TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS salt_returns (
+    jid TEXT NOT NULL, id TEXT NOT NULL, fun TEXT, ret TEXT NOT NULL,
+    PRIMARY KEY (jid, id)
+);
+'''
+
+
+def __virtual__():
+    return __virtualname__
+
+
+def _conn():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = sqlite3.connect(__opts__.get('sqlite_cache.database', ':memory:'))
+        conn.executescript(SCHEMA)
+    return conn
+
+
+def _fetch(sql: str, args=()):
+    global ROWS_FETCHED
+    rows = _conn().execute(sql, args).fetchall()
+    ROWS_FETCHED += len(rows)
+    return rows
+
+
+def prep_jid(nocache=False, passed_jid=None):
+    return passed_jid or salt.utils.jid.gen_jid(__opts__)
+
+
+def save_load(jid, load, minions=None):
+    if minions is not None:
+        load = dict(load, Minions=minions)
+    with _conn() as conn:
+        conn.execute('INSERT OR REPLACE INTO jids VALUES (?, ?)', (str(jid), json.dumps(load)))
+
+
+def save_minions(jid, minions, syndic_id=None):
+    load = get_load(jid)
+    save_load(jid, dict(load, Minions=minions))
+
+
+def returner(ret):
+    with _conn() as conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO salt_returns VALUES (?, ?, ?, ?)',
+            (str(ret['jid']), ret['id'], ret.get('fun'), json.dumps(ret))
+        )
+
+
+def get_load(jid):
+    rows = _fetch('SELECT load FROM jids WHERE jid = ?', (str(jid),))
+    return json.loads(rows[0][0]) if rows else {}
+
+
+def get_jid(jid):
+    return {
+        minion: {'return': ret.get('return'), 'retcode': ret.get('retcode'), 'success': ret.get('success')}
+        for minion, ret in ((row[0], json.loads(row[1])) for row in _fetch('SELECT id, ret FROM salt_returns WHERE jid = ?', (str(jid),)))
+    }
+
+
+def get_jids():
+    return {jid: salt.utils.jid.format_jid_instance(jid, json.loads(load)) for jid, load in _fetch('SELECT jid, load FROM jids')}
+
+
+def get_jids_filter(count, filter_find_job=True):
+    rows = _fetch('SELECT jid, load FROM (SELECT jid, load FROM jids ORDER BY jid DESC LIMIT ?) ORDER BY jid', (count,))
+    ret = []
+    for jid, load in rows:
+        job = salt.utils.jid.format_jid_instance_ext(jid, json.loads(load))
+        if filter_find_job and job['Function'] == 'saltutil.find_job':
+            continue
+        ret.append(job)
+    return ret
+
+
+def get_jids_since(jid):
+    return {
+        row_jid: salt.utils.jid.format_jid_instance(row_jid, json.loads(load))
+        for row_jid, load in _fetch('SELECT jid, load FROM jids WHERE jid >= ?', (str(jid),))
+    }
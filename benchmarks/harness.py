@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import subprocess
+import http.client
+from pathlib import Path
+from datetime import datetime
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'salt-exporter'))
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'fakes'))
+os.environ.setdefault('EXPORTER_STATE_FILE', os.path.join(tempfile.mkdtemp(), 'state.msgpack'))
+from master import FakeFleet, FakeMaster
+from modules.salt_master_local_client import override_clients
+from modules.exposition import start_metrics_server
+from modules.instrumentation import reset_peak_rss, peak_rss_bytes
+import exporter
+
+KEY_RESULTS = ('collect_data.p50', 'update_metrics.p50', 'merge_metrics.p50', 'scrape.p50', 'peak_rss_mib')
+
+
+def percentiles(values: list):
+    values = sorted(values)
+
+    def pick(q: float):
+        return values[min(len(values) - 1, int(len(values) * q))] * 1000
+    return {'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99), 'n': len(values)}
+
+
+def timed(func, runs: int):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def slave_payload(metrics: dict, slave: str):
+    # The local metrics relabeled as another master's fleet, as received JSON.
+    payload = json.loads(json.dumps(metrics, default=lambda o: o.as_dict()))
+    for value in payload.values():
+        if isinstance(value, list):
+            for sample in value:
+                if 'minion' in sample:
+                    sample['minion'] = f'{slave}-{sample["minion"]}'
+                if 'master' in sample:
+                    sample['master'] = slave
+    return payload
+
+
+def scrape(port: int, runs: int):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    size = 0
+
+    def get():
+        nonlocal size
+        conn.request('GET', '/metrics')
+        size = len(conn.getresponse().read())
+    timings = timed(get, runs)
+    conn.close()
+    return timings, size
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(path: Path, params: dict, results: dict):
+    previous = None
+    if path.exists():
+        with open(path) as fh:
+            for line in fh:
+                entry = json.loads(line)
+                if entry['params'] == params:
+                    previous = entry
+    if previous is None:
+        print('No previous run with the same parameters.')
+        return
+    print(f'Compared to {previous["version"]} ({previous["commit"]}) from {previous["timestamp"]}:')
+    for key in KEY_RESULTS:
+        old, new = previous['results'].get(key), results.get(key)
+        if old and new:
+            print(f'  {key:20} {old:10.2f} -> {new:10.2f} ({(new - old) / old * 100:+.1f}%)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the exporter against a fake salt master.')
+    parser.add_argument('--minions', type=int, default=10000)
+    parser.add_argument('--jobs-per-day', type=int, default=20000)
+    parser.add_argument('--states', type=int, default=20, help='States per job return.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every fake master call.')
+    parser.add_argument('--cycles', type=int, default=5)
+    parser.add_argument('--updates', type=int, default=20)
+    parser.add_argument('--slaves', type=int, default=5, help='Slave master payloads merged on top of the local one.')
+    parser.add_argument('--scrapes', type=int, default=100)
+    parser.add_argument('--port', type=int, default=19111)
+    parser.add_argument('--name', default='default', help='Result series to append to and compare with.')
+    parser.add_argument('--results', default=str(ROOT / 'benchmarks' / 'results'))
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+    logging.getLogger('exporter').setLevel(logging.WARNING)
+
+    params = {k: getattr(args, k) for k in ('minions', 'jobs_per_day', 'states', 'latency', 'cycles', 'updates', 'slaves', 'scrapes')}
+    fleet = FakeFleet(args.minions, args.jobs_per_day, args.states)
+    master = FakeMaster(fleet, args.latency)
+    override_clients(**master.clients())
+
+    reset_peak_rss()
+    salt_exporter = exporter.SaltMetricsExporter()
+    collect = timed(salt_exporter.collect_data, args.cycles)
+    update = timed(lambda: salt_exporter.update_metrics(salt_exporter.current_metrics), args.updates)
+
+    payloads = {f'slave{i}': slave_payload(salt_exporter.current_metrics, f'slave{i}') for i in range(args.slaves)}
+    merge = []
+    for _ in range(max(1, args.updates // max(1, args.slaves))):
+        for source, payload in payloads.items():
+            merge.extend(timed(lambda: salt_exporter.merge_metrics(source, payload), 1))
+    salt_exporter.update_metrics(salt_exporter.aggregator.merged())
+
+    server, _ = start_metrics_server(args.port, '127.0.0.1', salt_exporter.collector)
+    scrapes, scrape_size = scrape(args.port, args.scrapes)
+    server.shutdown()
+
+    results = {'peak_rss_mib': peak_rss_bytes() / 2 ** 20, 'scrape_bytes': scrape_size, 'returner_calls': master.returners.calls}
+    for name, timings in (('collect_data', collect), ('update_metrics', update), ('merge_metrics', merge), ('scrape', scrapes)):
+        for key, value in percentiles(timings).items():
+            results[f'{name}.{key}'] = value
+    results['collect_data.cold'] = collect[0] * 1000
+    results['collect_data.minions_per_s'] = args.minions / (sum(collect) / len(collect))
+    results['scrape.per_s'] = len(scrapes) / sum(scrapes)
+
+    print(f'{args.minions} minions, {args.jobs_per_day} jobs today, {args.states} states per return, {args.latency}s latency')
+    for name in ('collect_data', 'update_metrics', 'merge_metrics', 'scrape'):
+        print(f'{name:16} p50 {results[name + ".p50"]:9.2f}ms  p95 {results[name + ".p95"]:9.2f}ms  p99 {results[name + ".p99"]:9.2f}ms')
+    print(f'collect_data cold {results["collect_data.cold"]:.0f}ms, {results["collect_data.minions_per_s"]:.0f} minions/s')
+    print(f'scrape {results["scrape.per_s"]:.0f}/s, {scrape_size / 1024:.0f}KiB; peak RSS {results["peak_rss_mib"]:.1f}MiB; {master.returners.calls} returner calls')
+
+    path = Path(args.results) / f'{args.name}.jsonl'
+    compare(path, params, results)
+    if not args.no_save:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'a') as fh:
+            fh.write(json.dumps({
+                'version': exporter.__version__,
+                'commit': git_commit(),
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'params': params,
+                'results': results
+            }) + '\n')
+        print(f'Results appended to {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import re
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'salt-exporter'))
+from modules.jobs import FunctionClassifier, build_job_index
+
+
+FUNCTIONS = ['state.apply', 'state.highstate', 'test.ping', 'cmd.run', 'saltutil.sync_all', 'runner.jobs.active']
+EXCLUDED_PATTERNS = [re.compile(p) for p in ['^runner.*']]
+INCLUDED_PATTERNS = [re.compile(p) for p in ['.*']]
+
+
+def make_job_list(jobs: int, minions: list):
+    job_list = {}
+    base = 20250908000000000000
+    for i in range(jobs):
+        if random.random() < 0.8:
+            target = random.choice(minions)
+            details = {'Function': random.choice(FUNCTIONS), 'Target': target, 'Target-type': 'glob'}
+        else:
+            targeted = random.sample(minions, min(len(minions), 20))
+            details = {'Function': random.choice(FUNCTIONS), 'Target': 'web*', 'Target-type': 'glob', 'Minions': targeted}
+        job_list[str(base + i * 1000)] = details
+    return job_list
+
+
+def as_listed(job_list: dict):
+    # What a returner's get_jids lists: no "Minions", only get_load has them.
+    return {jid: {k: v for k, v in details.items() if k != 'Minions'} for jid, details in job_list.items()}
+
+
+def scan(job_list: dict, minion: str):
+    matching_job_ids = (
+        int(job_id) for job_id, details in job_list.items()
+        if details.get('Target') == minion
+        and not any(p.match(details.get('Function', '')) for p in EXCLUDED_PATTERNS)
+        and any(p.match(details.get('Function', '')) for p in INCLUDED_PATTERNS)
+    )
+    return max(matching_job_ids, default=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-minion job scan vs. single-pass job index.')
+    parser.add_argument('--minions', type=int, default=4000)
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--sample', type=int, default=50, help='Minions timed for the per-minion scan (extrapolated to the fleet).')
+    args = parser.parse_args()
+
+    random.seed(0)
+    minions = [f'minion{i}' for i in range(args.minions)]
+    print(f'{"jobs":>8} {"scan (s)":>12} {"index (s)":>12} {"lookup (s)":>12}')
+    for jobs in args.jobs:
+        job_list = make_job_list(jobs, minions)
+
+        sample = minions[:args.sample]
+        start = time.perf_counter()
+        for minion in sample:
+            scan(job_list, minion)
+        scan_time = (time.perf_counter() - start) * len(minions) / len(sample)
+
+        start = time.perf_counter()
+        index = build_job_index(job_list, FunctionClassifier(['^runner.*'], ['.*']))
+        index_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for minion in minions:
+            index.get(minion)
+        lookup_time = time.perf_counter() - start
+
+        print(f'{jobs:>8} {scan_time:>12.3f} {index_time:>12.3f} {lookup_time:>12.5f}')
+
+        # Glob targets of a get_jids listing are expanded through the load.
+        loads = []
+
+        def resolve(jid, details):
+            loads.append(jid)
+            return job_list[jid].get('Minions')
+
+        listed = build_job_index(as_listed(job_list), FunctionClassifier(['^runner.*'], ['.*']), resolve)
+        assert listed == index, 'glob targets of listed jobs were not expanded'
+        print(f'{"":>8} listed without Minions: same index, {len(loads)} loads for {sum("Minions" in d for d in job_list.values())} glob jobs')
+
+
+if __name__ == '__main__':
+    main()
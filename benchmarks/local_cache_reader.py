@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import math
+import msgpack
+import salt.returners.local_cache as local_cache
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'salt-exporter'))
+from modules.local_cache import LocalCacheReader
+from modules.jobs import summarize_return
+
+
+FUNCTIONS = ['state.apply', 'state.highstate', 'test.ping', 'cmd.run', 'saltutil.sync_all']
+
+
+def job_path(jobs_dir: str, jid: str):
+    digest = hashlib.sha256(jid.encode()).hexdigest()
+    return os.path.join(jobs_dir, digest[:2], digest[2:])
+
+
+def write_job(jobs_dir: str, jid: str, minions: list, states: int, syndic_minions: list = (), load: bool = True):
+    job_dir = job_path(jobs_dir, jid)
+    os.makedirs(job_dir)
+    with open(os.path.join(job_dir, 'jid'), 'w') as fh:
+        fh.write(jid)
+    if load:
+        write_load(jobs_dir, jid, minions)
+    if syndic_minions:
+        with open(os.path.join(job_dir, '.minions.syndic1.p'), 'wb') as fh:
+            fh.write(msgpack.packb(list(syndic_minions)))
+    for minion in minions:
+        os.makedirs(os.path.join(job_dir, minion))
+        ret = {
+            'return': {
+                f'state_{i}': {'duration': random.random() * 1000, 'result': i % 7 != 3, 'changes': {'diff': 'y' * 256}}
+                for i in range(states)
+            },
+            'retcode': 0 if states < 4 else 2,
+            'success': True
+        }
+        with open(os.path.join(job_dir, minion, 'return.p'), 'wb') as fh:
+            fh.write(msgpack.packb(ret))
+
+
+def write_load(jobs_dir: str, jid: str, minions: list):
+    job_dir = job_path(jobs_dir, jid)
+    load = {'jid': jid, 'fun': random.choice(FUNCTIONS), 'tgt': minions[0] if len(minions) == 1 else 'web*', 'tgt_type': 'glob', 'arg': ['x' * 512], 'user': 'root'}
+    with open(os.path.join(job_dir, '.load.p'), 'wb') as fh:
+        fh.write(msgpack.packb(load))
+    with open(os.path.join(job_dir, '.minions.p'), 'wb') as fh:
+        fh.write(msgpack.packb(minions))
+
+
+def check_listing(jobs: dict, expected: dict):
+    # The reader must list what the local_cache returner's get_jids/get_load do.
+    assert jobs.keys() == expected.keys(), f'listed {len(jobs)} jobs, get_jids has {len(expected)}'
+    for jid, job in jobs.items():
+        reference = expected[jid]
+        for field in ('Function', 'Target', 'Target-type'):
+            assert job[field] == reference[field], f'{jid} {field}: {job[field]!r} != {reference[field]!r}'
+        if 'Arguments' in job:
+            assert job['Arguments'] == reference['Arguments'], f'{jid} Arguments differ'
+        assert job.get('Minions', []) == sorted(local_cache.get_load(jid).get('Minions', [])), f'{jid} minions differ'
+
+
+def check_summary(job: dict, jid: str):
+    # Return summaries must match the ones built from the full get_jid returns.
+    returns = local_cache.get_jid(jid)
+    assert job['Result'].keys() == returns.keys(), f'{jid} returns of {sorted(returns)} expected'
+    for minion, summary in job['Result'].items():
+        reference = summarize_return(returns[minion])
+        assert math.isclose(summary['duration'], reference['duration']), f'{jid} {minion} duration differs'
+        assert (summary['retcode'], summary['failed']) == (reference['retcode'], reference['failed']), f'{jid} {minion} summary differs'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Native local_cache reader against a synthetic job cache.')
+    parser.add_argument('--jobs', type=int, default=200000)
+    parser.add_argument('--new-jobs', type=int, default=500)
+    parser.add_argument('--states', type=int, default=200, help='States per return of the sampled job.')
+    parser.add_argument('--dir', help='Reuse or create the synthetic job cache here, a directory named "jobs" like in the salt cachedir.')
+    args = parser.parse_args()
+
+    random.seed(0)
+    jobs_dir = args.dir or os.path.join(tempfile.mkdtemp(prefix='salt-cache-'), 'jobs')
+    os.makedirs(jobs_dir, exist_ok=True)
+    local_cache.__opts__ = {'cachedir': os.path.dirname(jobs_dir), 'hash_type': 'sha256'}
+    base = 20250908000000000000
+    if not os.listdir(jobs_dir):
+        start = time.perf_counter()
+        for i in range(args.jobs):
+            write_job(jobs_dir, str(base + i * 1000), [f'minion{i % 4000}'], 0)
+        print(f'Wrote {args.jobs} jobs to {jobs_dir} in {time.perf_counter() - start:.1f}s')
+
+    reader = LocalCacheReader(jobs_dir)
+    start = time.perf_counter()
+    jobs = reader.list_jobs()
+    print(f'Initial scan: {len(jobs)} jobs in {time.perf_counter() - start:.3f}s')
+
+    start = time.perf_counter()
+    jobs = reader.list_jobs(max(jobs))
+    print(f'Rescan without changes: {len(jobs)} jobs in {time.perf_counter() - start:.3f}s')
+
+    last = base + (args.jobs + 1) * 1000
+    for i in range(args.new_jobs):
+        write_job(jobs_dir, str(last + i * 1000), [f'minion{i % 4000}'], 0)
+    sampled = str(last + args.new_jobs * 1000)
+    write_job(jobs_dir, sampled, [f'minion{i}' for i in range(25)], args.states, [f'syndic-minion{i}' for i in range(5)])
+    start = time.perf_counter()
+    jobs = reader.list_jobs(str(last - 1))
+    print(f'Incremental scan: {len(jobs)} new jobs in {time.perf_counter() - start:.3f}s')
+    check_listing(jobs, {jid: job for jid, job in local_cache.get_jids().items() if jid >= str(last - 1)})
+
+    start = time.perf_counter()
+    job = reader.get_job(sampled)
+    print(f'Summarized {len(job["Result"])} returns of {args.states} states in {time.perf_counter() - start:.3f}s')
+    check_summary(job, sampled)
+
+    # Salt writes the jid file before the load: a directory listed in between
+    # must be listed again once the load is there.
+    late = str(last + (args.new_jobs + 1) * 1000)
+    write_job(jobs_dir, late, ['minion0'], 1, load=False)
+    assert reader.list_jobs(sampled) == {}, 'job listed before its load was written'
+    write_load(jobs_dir, late, ['minion0'])
+    jobs = reader.list_jobs(sampled)
+    check_listing(jobs, {late: local_cache.get_jids()[late]})
+    print('Listings and summaries match the local_cache returner.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+import threading
+import gzip
+import json
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'salt-exporter'))
+os.environ.setdefault('EXPORTER_STATE_FILE', '')
+import exporter
+from modules.aggregation import MultimasterAggregator
+from modules.push import PushClient
+from modules.samples import plain
+
+METRICS_INFO = exporter.SaltMetricsExporter.METRICS_INFO
+
+
+def make_payload(master: str, minions: list, churn: float):
+    statuses = [{'minion': m, 'value': 0 if random.random() < 0.05 else 1} for m in minions]
+    up = sum(s['value'] for s in statuses)
+    payload = {name: [] if meta.get('labels') else {'value': 0} for name, meta in METRICS_INFO.items()}
+    payload.update({
+        'salt_all_jobs_total': {'value': 1000},
+        'salt_active_jobs_total': {'value': 3},
+        'salt_minions_up_total': {'value': up},
+        'salt_minions_down_total': {'value': len(minions) - up},
+        'salt_minions_total': {'value': len(minions)},
+        'salt_accepted_minions_total': {'value': len(minions)},
+        'salt_minion_job_duration_seconds': [
+            {'master': master, 'minion': m, 'jid': 20250908000000000000 + (i if random.random() > churn else i + 1), 'fun': 'state.apply', 'value': random.random()}
+            for i, m in enumerate(minions)
+        ],
+        'salt_minion_job_retcode': [{'master': master, 'minion': m, 'fun': 'state.apply', 'value': 0} for m in minions],
+        'salt_minion_status': statuses,
+        'salt_minion_version': [{'minion': m, 'version': '3006.9', 'value': 1} for m in minions],
+        'salt_master_version': [{'master': master, 'version': '3006.9', 'value': 1}]
+    })
+    return payload
+
+
+def start_receiver(port: int):
+    # The main master's receiver: POSTs go through the asyncio endpoint, its
+    # queue and coalescing worker into apply_received, as in production.
+    salt_exporter = exporter.SaltMetricsExporter()
+    applied = []
+    apply_received = salt_exporter.apply_received
+
+    def counted(batch):
+        start = time.perf_counter()
+        apply_received(batch)
+        applied.append((len(batch), time.perf_counter() - start))
+
+    salt_exporter.apply_received = counted
+    threading.Thread(target=lambda: asyncio.run(salt_exporter.run_receiver('127.0.0.1', port)), daemon=True).start()
+    time.sleep(0.3)
+    return salt_exporter, applied
+
+
+def wait_applied(applied: list, posted: int, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while sum(size for size, _ in applied) < posted:
+        assert time.monotonic() < deadline, f'{sum(size for size, _ in applied)} of {posted} payloads merged'
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent slave masters posting into the receiver of the main master.')
+    parser.add_argument('--masters', type=int, default=12)
+    parser.add_argument('--minions', type=int, default=1000, help='Minions per master.')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--churn', type=float, default=0.05)
+    parser.add_argument('--port', type=int, default=19113)
+    parser.add_argument('--regions', type=int, default=0, help='Also merge through this many relay masters and compare.')
+    args = parser.parse_args()
+
+    random.seed(0)
+    salt_exporter, applied = start_receiver(args.port)
+    aggregator = salt_exporter.aggregator
+    url = f'http://127.0.0.1:{args.port}'
+    masters = [f'master{i}' for i in range(args.masters)]
+    fleets = {master: [f'{master}-minion{i}' for i in range(args.minions)] for master in masters}
+    clients = {master: PushClient(url, METRICS_INFO, {'X-Salt-Master': master}) for master in masters}
+    latencies = []
+    statuses = {}
+    posted = 0
+
+    def post(master):
+        payload = make_payload(master, fleets[master], args.churn)
+        start = time.perf_counter()
+        response = clients[master].push(payload)
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        return payload
+
+    rounds = []
+    with ThreadPoolExecutor(max_workers=args.masters) as executor:
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            last = dict(zip(masters, executor.map(post, masters)))
+            posted += len(masters)
+            wait_applied(applied, posted)
+            rounds.append(time.perf_counter() - start)
+    assert statuses == {202: len(latencies)}, f'statuses {statuses}'
+
+    merged = aggregator.merged()
+    expected_up = sum(p['salt_minions_up_total']['value'] for p in last.values())
+    assert merged['salt_minions_total']['value'] == args.masters * args.minions
+    assert merged['salt_minions_up_total']['value'] == expected_up
+    assert merged['salt_all_jobs_total']['value'] == 1000 * args.masters
+    assert len(merged['salt_minion_job_duration_seconds']) == args.masters * args.minions
+    assert canonical(merged) == canonical(flat_merge(last)), 'received merge must match merging the last payloads directly'
+
+    clients[masters[0]].push(last[masters[0]])
+    wait_applied(applied, posted + 1)
+    assert aggregator.merged() == merged, 'replaying a payload must not change the merged view'
+
+    latencies.sort()
+    merges = sorted(elapsed for _, elapsed in applied)
+    sent = sum(client.bytes_sent for client in clients.values())
+    print(f'{args.masters} masters x {args.minions} minions, {len(latencies)} POSTs, {sent / 2 ** 20:.1f}MiB gzipped')
+    print(f'POST latency p50 {statistics.median(latencies) * 1000:.1f}ms, p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f}ms')
+    print(f'{len(applied)} merges, p50 {statistics.median(merges) * 1000:.1f}ms; round merged {statistics.median(rounds) * 1000:.0f}ms after its first POST (p50)')
+    start = time.perf_counter()
+    aggregator.merged()
+    print(f'merged view built in {(time.perf_counter() - start) * 1000:.1f}ms')
+
+    if args.regions:
+        relayed(args, masters, last, merged)
+
+
+def flat_merge(payloads: dict):
+    aggregator = MultimasterAggregator(METRICS_INFO, 'main', ttl=3600)
+    for master, payload in payloads.items():
+        aggregator.update(master, json.loads(json.dumps(payload, default=plain)))
+    return aggregator.merged()
+
+
+def canonical(merged: dict):
+    return {
+        name: sorted(tuple(sample.items()) for sample in value) if isinstance(value, list) else value
+        for name, value in merged.items()
+    }
+
+
+def payload_size(payload: dict):
+    return len(gzip.compress(json.dumps(payload, default=plain).encode()))
+
+
+def relayed(args, masters: list, last: dict, flat: dict):
+    # Same payloads through relay masters: every relay merges its region and
+    # forwards one payload, the top-level receiver merges one per region.
+    regions = {f'relay{i}': masters[i::args.regions] for i in range(args.regions)}
+    top = MultimasterAggregator(METRICS_INFO, 'main', ttl=3600)
+    received = 0
+    start = time.perf_counter()
+    for relay, members in regions.items():
+        aggregator = MultimasterAggregator(METRICS_INFO, relay, ttl=3600)
+        for master in members:
+            aggregator.update(master, last[master])
+        payload = aggregator.merged()
+        received += payload_size(payload)
+        top.update(relay, payload)
+    elapsed = time.perf_counter() - start
+    assert canonical(top.merged()) == canonical(flat), 'relayed merge must match the flat one'
+
+    direct = sum(payload_size(payload) for payload in last.values())
+    print(f'{args.regions} relays: top-level receiver merges {args.regions} payloads instead of {len(masters)},'
+          f' {received / 2 ** 20:.1f}MiB instead of {direct / 2 ** 20:.1f}MiB gzipped per round')
+    print(f'relayed round merged in {elapsed * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
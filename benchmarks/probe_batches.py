@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'salt-exporter'))
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'fakes'))
+
+
+class StreamingLocalClient:
+    # Returns arrive per minion after a random reply time, down minions never
+    # reply, like cmd_iter_no_block against real minions. Publish times are
+    # recorded.
+    def __init__(self, down: set, reply_time: float):
+        self.down = down
+        self.reply_time = reply_time
+        self.published = []
+
+    def cmd_iter_no_block(self, tgt, fun, tgt_type='glob', expect_minions=False, **kwargs):
+        start = time.monotonic()
+        self.published.append(start)
+        replies = sorted((random.uniform(0, self.reply_time), minion) for minion in tgt if minion not in self.down)
+        yield None
+        for at, minion in replies:
+            while time.monotonic() - start < at:
+                yield None
+            yield {minion: {'ret': True, 'retcode': 0}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Spread of batched minion probe publishes.')
+    parser.add_argument('--minions', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--batch-timeout', type=int, default=1)
+    parser.add_argument('--reply-time', type=float, default=0.3, help='Maximum reply time of a minion in seconds.')
+    parser.add_argument('--down', type=int, default=2, help='Minions that never reply.')
+    args = parser.parse_args()
+    os.environ.update(
+        EXPORTER_PROBE_BATCH_SIZE=str(args.batch_size),
+        EXPORTER_PROBE_BATCH_TIMEOUT=str(args.batch_timeout),
+        EXPORTER_STATE_FILE=''
+    )
+    from master import FakeFleet, FakeKey
+    from modules.salt_master_local_client import override_clients
+    import exporter
+
+    random.seed(0)
+    fleet = FakeFleet(args.minions, 0)
+    client = StreamingLocalClient(set(fleet.minions[:args.down]), args.reply_time)
+    override_clients(key=FakeKey(fleet, 0), local_client=client)
+    salt_exporter = exporter.SaltMetricsExporter()
+
+    start = time.monotonic()
+    statuses = salt_exporter._probe_minions()
+    offsets = [at - client.published[0] for at in client.published]
+    print(f'{len(client.published)} batches published at {", ".join(f"{offset:.2f}s" for offset in offsets)}')
+    print(f'{len(statuses["up"])} up, {len(statuses["down"])} down in {time.monotonic() - start:.2f}s')
+
+    batches = -(-args.minions // args.batch_size)
+    assert len(client.published) == batches, f'{batches} batches expected'
+    assert len(statuses['down']) == args.down, f'{args.down} down minions expected'
+    for previous, offset in zip(offsets, offsets[1:]):
+        assert offset - previous >= 0.05, 'a batch was published before the previous one settled'
+    if args.down:
+        # The first batch holds the silent minions and only settles by its timeout.
+        assert offsets[1] - offsets[0] >= args.batch_timeout, 'the second batch did not wait for the batch timeout'
+    print('Publishes are spread over the returns of the previous batches.')
+
+
+if __name__ == '__main__':
+    main()
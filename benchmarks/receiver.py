@@ -0,0 +1,75 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import http.client
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'salt-exporter'))
+from modules.receiver import AsyncReceiver
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Request latency and throughput of the async receiver.')
+    parser.add_argument('--slaves', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=20, help='POSTs per slave.')
+    parser.add_argument('--minions', type=int, default=1000, help='Minion samples per payload.')
+    parser.add_argument('--merge-ms', type=float, default=100, help='Simulated merge and render time.')
+    parser.add_argument('--port', type=int, default=19112)
+    args = parser.parse_args()
+
+    applied = []
+
+    def apply(batch):
+        time.sleep(args.merge_ms / 1000)
+        applied.append(len(batch))
+
+    receiver = None
+    ready = threading.Event()
+
+    def serve():
+        async def start():
+            nonlocal receiver
+            receiver = AsyncReceiver(apply)
+            ready.set()
+            await receiver.serve('127.0.0.1', args.port)
+
+        asyncio.run(start())
+
+    threading.Thread(target=serve, daemon=True).start()
+    ready.wait()
+    time.sleep(0.2)
+
+    body = json.dumps({'salt_minion_status': [{'minion': f'minion{i}', 'value': 1} for i in range(args.minions)]}).encode()
+    latencies = []
+    statuses = {}
+
+    def slave(index):
+        conn = http.client.HTTPConnection('127.0.0.1', args.port)
+        for _ in range(args.posts):
+            start = time.perf_counter()
+            conn.request('POST', '/', body=body, headers={'Content-Type': 'application/json', 'X-Salt-Master': f'slave{index}'})
+            response = conn.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+        conn.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.slaves) as executor:
+        list(executor.map(slave, range(args.slaves)))
+    elapsed = time.perf_counter() - start
+    time.sleep(receiver.coalesce_window + args.merge_ms / 1000 + 0.5)
+
+    latencies.sort()
+    total = len(latencies)
+    print(f'{args.slaves} slaves x {args.posts} POSTs of {len(body) / 1024:.0f} KiB: {total / elapsed:.0f} req/s, statuses {statuses}')
+    print(f'latency p50 {latencies[total // 2] * 1000:.2f}ms, p95 {latencies[int(total * 0.95)] * 1000:.2f}ms, p99 {latencies[int(total * 0.99)] * 1000:.2f}ms')
+    print(f'{sum(applied)} payloads merged in {len(applied)} batches')
+
+
+if __name__ == '__main__':
+    main()
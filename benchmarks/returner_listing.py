@@ -0,0 +1,107 @@
+import sys
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+from datetime import datetime, timedelta
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'salt-exporter'))
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'fakes'))
+import sqlite_returner
+from modules.jobs import list_returner_jobs
+from modules.salt_master_local_client import JidCache
+
+FUNCTIONS = ['state.apply', 'test.ping', 'cmd.run', 'saltutil.find_job']
+# strategy: (returner calls offered, returners allowed to use get_jids_filter)
+STRATEGIES = {
+    'get_jids': (('get_jids',), ()),
+    'unlisted filter': (('get_jids', 'get_jids_filter'), ()),
+    'get_jids_filter': (('get_jids', 'get_jids_filter'), ('sqlite_cache',)),
+    'get_jids_since': (('get_jids', 'get_jids_filter', 'get_jids_since'), ()),
+}
+
+
+def jid_at(moment: datetime, seq: int):
+    return moment.strftime('%Y%m%d%H%M%S') + f'{seq % 1000000:06d}'
+
+
+def add_jobs(start: datetime, jobs: int, span: timedelta, seq: int):
+    step = span / jobs
+    for i in range(jobs):
+        jid = jid_at(start + step * i, seq + i)
+        sqlite_returner.save_load(jid, {'fun': random.choice(FUNCTIONS), 'tgt': f'minion-{i % 500}', 'tgt_type': 'glob', 'arg': []})
+    return seq + jobs
+
+
+def jids_since(lower: str):
+    # Straight from the database, not counted as fetched rows.
+    return {row[0] for row in sqlite_returner._conn().execute('SELECT jid FROM jids WHERE jid >= ?', (lower,))}
+
+
+def check_listing(name: str, cycle: int, jobs: dict, lower: str):
+    expected = {jid: job for jid, job in sqlite_returner.get_jids().items() if jid >= lower}
+    assert set(jobs) == set(expected), f'{name}: cycle {cycle} listed {len(jobs)} jobs, {len(expected)} expected'
+    for jid, job in jobs.items():
+        assert {key: job[key] for key in ('Function', 'Target', 'StartTime')} == {key: expected[jid][key] for key in ('Function', 'Target', 'StartTime')}, f'{name}: {jid} differs'
+
+
+def check_returner(lower: str, count: int = 50):
+    # The fake's narrow calls agree with its get_jids.
+    jobs = sqlite_returner.get_jids()
+    newest = sorted(jobs)[-count:]
+    assert [job['JID'] for job in sqlite_returner.get_jids_filter(count, filter_find_job=False)] == newest, 'get_jids_filter differs from get_jids'
+    filtered = [jid for jid in newest if jobs[jid]['Function'] != 'saltutil.find_job']
+    assert [job['JID'] for job in sqlite_returner.get_jids_filter(count)] == filtered, 'get_jids_filter kept find_job'
+    assert sqlite_returner.get_jids_since(lower) == {jid: job for jid, job in jobs.items() if jid >= lower}, 'get_jids_since differs from get_jids'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Job listing cost per returner capability, SQLite stand-in for a database job cache.')
+    parser.add_argument('--days', type=int, default=30, help='Days of history in the job cache.')
+    parser.add_argument('--jobs-per-day', type=int, default=5000)
+    parser.add_argument('--cycles', type=int, default=10)
+    parser.add_argument('--jobs-per-cycle', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite_returner.__opts__['sqlite_cache.database'] = f'{tmp}/jobs.db'
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        seq = add_jobs(today - timedelta(days=args.days), args.jobs_per_day * args.days, timedelta(days=args.days), 0)
+        print(f'{args.jobs_per_day * args.days} jobs over {args.days} days, {args.cycles} cycles with {args.jobs_per_cycle} new jobs each')
+        print(f'{"strategy":>16} {"first cycle":>12} {"next cycles":>12} {"rows/cycle":>11} {"jobs today":>11}')
+
+        lower = today.strftime('%Y%m%d%H%M%S') + '000000'
+        now = datetime.now()
+        check_returner(jid_at(today - timedelta(days=args.days / 2), 0))
+        for name, (calls, filtering) in STRATEGIES.items():
+            returners = {f'sqlite_cache.{call}': getattr(sqlite_returner, call) for call in calls}
+            cache = JidCache()
+            timings = []
+            rows = []
+            for cycle in range(args.cycles):
+                if cycle:
+                    seq = add_jobs(now, args.jobs_per_cycle, timedelta(seconds=1), seq)
+                    # Saved late, older than jobs listed before.
+                    seq = add_jobs(now - timedelta(seconds=30), 1, timedelta(seconds=1), seq)
+                    now += timedelta(seconds=2)
+                fetched = sqlite_returner.ROWS_FETCHED
+                start = time.perf_counter()
+                jobs = cache.refresh(lower, None, lambda last_jid, low: list_returner_jobs(returners, 'sqlite_cache', last_jid or low, filtering=filtering))
+                timings.append(time.perf_counter() - start)
+                rows.append(sqlite_returner.ROWS_FETCHED - fetched)
+                check_listing(name, cycle, jobs, lower)
+                if 'get_jids_since' not in calls and not filtering:
+                    # get_jids_filter of a returner not known to filter in
+                    # the database is never called: one get_jids per cycle.
+                    assert rows[-1] == len(jids_since('')), f'{name}: cycle {cycle} read {rows[-1]} rows, one get_jids expected'
+            rest = timings[1:] or timings
+            print(
+                f'{name:>16} {timings[0] * 1000:>10.1f}ms {sum(rest) / len(rest) * 1000:>10.1f}ms'
+                f' {sum(rows[1:]) / max(1, len(rows) - 1):>11.0f} {len(jobs):>11}'
+            )
+        print('Every strategy listed the jobs of the day with the details get_jids returns.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+
+EXPORTER_DIR = Path(__file__).resolve().parent.parent / 'salt-exporter'
+
+# Every variant runs in a fresh interpreter so RSS is not shared between them.
+# Label strings are built per sample, the way they come out of salt returns.
+PROBE = '''
+import sys, gc, json, tracemalloc
+sys.path.insert(0, {path!r})
+from modules.samples import sample_type
+
+def rss():
+    with open('/proc/self/status') as fh:
+        for line in fh:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+
+minions, records = {minions}, {records}
+status = sample_type(('minion',))
+version = sample_type(('minion', 'version'))
+duration = sample_type(('master', 'minion', 'jid', 'fun'))
+retcode = sample_type(('master', 'minion', 'fun'))
+names = ['minion-%06d.example.com' % i for i in range(minions)]
+gc.collect()
+base = rss()
+tracemalloc.start()
+metrics = {{}}
+if records:
+    metrics['status'] = [status(''.join(n), 1) for n in names]
+    metrics['version'] = [version(''.join(n), '3006.9', 1) for n in names]
+    metrics['duration'] = [duration('master-1', ''.join(n), 20250908000000000000 + i, 'state.apply', 12.5) for i, n in enumerate(names)]
+    metrics['retcode'] = [retcode('master-1', ''.join(n), 'state.apply', 0) for n in names]
+else:
+    metrics['status'] = [{{'minion': ''.join(n), 'value': 1}} for n in names]
+    metrics['version'] = [{{'minion': ''.join(n), 'version': '3006.9', 'value': 1}} for n in names]
+    metrics['duration'] = [{{'master': 'master-1', 'minion': ''.join(n), 'jid': 20250908000000000000 + i, 'fun': 'state.apply', 'value': 12.5}} for i, n in enumerate(names)]
+    metrics['retcode'] = [{{'master': 'master-1', 'minion': ''.join(n), 'fun': 'state.apply', 'value': 0}} for n in names]
+traced = tracemalloc.get_traced_memory()[0]
+tracemalloc.stop()
+gc.collect()
+print(json.dumps({{'traced': traced, 'rss': rss() - base}}))
+'''
+
+
+def run(minions: int, records: bool):
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE.format(path=str(EXPORTER_DIR), minions=minions, records=records)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory of collected samples: dicts vs slotted records.')
+    parser.add_argument('--minions', default='10000,50000,100000', help='Comma-separated fleet sizes.')
+    args = parser.parse_args()
+
+    print(f'{"minions":>8} {"dicts MiB":>10} {"records MiB":>12} {"RSS dicts":>10} {"RSS records":>12}')
+    for minions in [int(m) for m in args.minions.split(',')]:
+        dicts = run(minions, False)
+        records = run(minions, True)
+        print(
+            f'{minions:>8} {dicts["traced"] / 2 ** 20:>10.1f} {records["traced"] / 2 ** 20:>12.1f}'
+            f' {dicts["rss"] / 2 ** 20:>10.1f} {records["rss"] / 2 ** 20:>12.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+EXPORTER_DIR = Path(__file__).resolve().parent.parent / 'salt-exporter'
+
+# Runs in a fresh interpreter so every sample is a cold start. Needs a salt
+# master configuration in /etc/salt/master, like the exporter itself.
+PROBE = '''
+import sys, json, time, resource
+sys.path.insert(0, {path!r})
+timings = {{}}
+start = time.perf_counter()
+import modules.salt_master_local_client as client
+timings['import'] = time.perf_counter() - start
+rss = {{'import': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}}
+for name in {clients!r}:
+    start = time.perf_counter()
+    getattr(client, 'get_' + name)()
+    timings[name] = time.perf_counter() - start
+rss['total'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+print(json.dumps({{'timings': timings, 'rss': rss}}))
+'''
+CLIENTS = ('returners', 'salt_key', 'salt_runner', 'salt_client')
+
+
+def run_once(clients: list):
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE.format(path=str(EXPORTER_DIR), clients=clients)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start time and RSS of the salt client module.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--clients', default=','.join(CLIENTS), help='Clients to build after the import, in order.')
+    args = parser.parse_args()
+
+    clients = [name for name in args.clients.split(',') if name]
+    results = [run_once(clients) for _ in range(args.runs)]
+    print(f'{args.runs} cold starts')
+    for stage in ['import'] + clients:
+        values = [r['timings'][stage] for r in results]
+        print(f'{stage:12} median {statistics.median(values) * 1000:8.1f}ms, max {max(values) * 1000:8.1f}ms')
+    for stage in ('import', 'total'):
+        print(f'peak RSS after {stage}: {statistics.median(r["rss"][stage] for r in results) / 2 ** 20:.1f}MiB')
+
+
+if __name__ == '__main__':
+    main()
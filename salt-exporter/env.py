@@ -1,5 +1,4 @@
 import os
-import re
 import socket
 import configparser
 from pathlib import Path
@@ -26,6 +25,32 @@ EXPORTER_INCLUDED_FUNCTIONS = os.getenv('EXPORTER_INCLUDED_FUNCTIONS').split(','
 EXPORTER_MAIN_MASTER = os.getenv('EXPORTER_MAIN_MASTER') == 'True' if os.getenv('EXPORTER_MAIN_MASTER') else (config.get('main', 'main_master') == 'True' if config_exists and config.has_option('main', 'main_master') else True)
 EXPORTER_MAIN_MASTER_ADDR = os.getenv('EXPORTER_MAIN_MASTER_ADDR') if os.getenv('EXPORTER_MAIN_MASTER_ADDR') else (config.get('main', 'main_master_addr') if config_exists and config.has_option('main', 'main_master_addr') else '0.0.0.0')
 EXPORTER_MULTIMASTER_ENABLED = os.getenv('EXPORTER_MULTIMASTER_ENABLED') == 'True' if os.getenv('EXPORTER_MULTIMASTER_ENABLED') else (config.get('main', 'multimaster_mode') == 'True' if config_exists and config.has_option('main', 'multimaster_mode') else False)
-EXCLUDED_PATTERNS = [re.compile(p) for p in EXPORTER_EXCLUDED_FUNCTIONS]
-INCLUDED_PATTERNS = [re.compile(p) for p in EXPORTER_INCLUDED_FUNCTIONS]
+EXPORTER_JOB_CACHE_SIZE = int(os.getenv('EXPORTER_JOB_CACHE_SIZE')) if os.getenv('EXPORTER_JOB_CACHE_SIZE') else (int(config.get('main', 'job_cache_size')) if config_exists and config.has_option('main', 'job_cache_size') else 10000)
+EXPORTER_EVENT_STREAM = os.getenv('EXPORTER_EVENT_STREAM') == 'True' if os.getenv('EXPORTER_EVENT_STREAM') else (config.get('main', 'event_stream') == 'True' if config_exists and config.has_option('main', 'event_stream') else False)
+EXPORTER_STAGE_TIMEOUT = int(os.getenv('EXPORTER_STAGE_TIMEOUT')) if os.getenv('EXPORTER_STAGE_TIMEOUT') else (int(config.get('main', 'stage_timeout')) if config_exists and config.has_option('main', 'stage_timeout') else 120)
+EXPORTER_PROBE_BATCH_SIZE = int(os.getenv('EXPORTER_PROBE_BATCH_SIZE')) if os.getenv('EXPORTER_PROBE_BATCH_SIZE') else (int(config.get('main', 'probe_batch_size')) if config_exists and config.has_option('main', 'probe_batch_size') else 0)
+EXPORTER_PROBE_BATCH_TIMEOUT = int(os.getenv('EXPORTER_PROBE_BATCH_TIMEOUT')) if os.getenv('EXPORTER_PROBE_BATCH_TIMEOUT') else (int(config.get('main', 'probe_batch_timeout')) if config_exists and config.has_option('main', 'probe_batch_timeout') else 5)
+EXPORTER_PROBE_DEADLINE = int(os.getenv('EXPORTER_PROBE_DEADLINE')) if os.getenv('EXPORTER_PROBE_DEADLINE') else (int(config.get('main', 'probe_deadline')) if config_exists and config.has_option('main', 'probe_deadline') else 60)
+EXPORTER_NATIVE_JOB_CACHE = os.getenv('EXPORTER_NATIVE_JOB_CACHE') == 'True' if os.getenv('EXPORTER_NATIVE_JOB_CACHE') else (config.get('main', 'native_job_cache') == 'True' if config_exists and config.has_option('main', 'native_job_cache') else False)
+EXPORTER_SOURCE_TTL = int(os.getenv('EXPORTER_SOURCE_TTL')) if os.getenv('EXPORTER_SOURCE_TTL') else (int(config.get('main', 'source_ttl')) if config_exists and config.has_option('main', 'source_ttl') else EXPORTER_COLLECT_DELAY * 3)
+EXPORTER_PUSH_FULL_EVERY = int(os.getenv('EXPORTER_PUSH_FULL_EVERY')) if os.getenv('EXPORTER_PUSH_FULL_EVERY') else (int(config.get('main', 'push_full_every')) if config_exists and config.has_option('main', 'push_full_every') else 12)
+EXPORTER_PUSH_TIMEOUT = int(os.getenv('EXPORTER_PUSH_TIMEOUT')) if os.getenv('EXPORTER_PUSH_TIMEOUT') else (int(config.get('main', 'push_timeout')) if config_exists and config.has_option('main', 'push_timeout') else 10)
+EXPORTER_PUSH_SPOOL_SIZE = int(os.getenv('EXPORTER_PUSH_SPOOL_SIZE')) if os.getenv('EXPORTER_PUSH_SPOOL_SIZE') else (int(config.get('main', 'push_spool_size')) if config_exists and config.has_option('main', 'push_spool_size') else 3)
+EXPORTER_PUSH_BACKOFF_MAX = int(os.getenv('EXPORTER_PUSH_BACKOFF_MAX')) if os.getenv('EXPORTER_PUSH_BACKOFF_MAX') else (int(config.get('main', 'push_backoff_max')) if config_exists and config.has_option('main', 'push_backoff_max') else 300)
+EXPORTER_JOB_DURATION_MODE = os.getenv('EXPORTER_JOB_DURATION_MODE') if os.getenv('EXPORTER_JOB_DURATION_MODE') else (config.get('main', 'job_duration_mode') if config_exists and config.has_option('main', 'job_duration_mode') else 'jid')
+EXPORTER_JOB_DURATION_TOP_K = int(os.getenv('EXPORTER_JOB_DURATION_TOP_K')) if os.getenv('EXPORTER_JOB_DURATION_TOP_K') else (int(config.get('main', 'job_duration_top_k')) if config_exists and config.has_option('main', 'job_duration_top_k') else 10)
+EXPORTER_SERIES_LIMIT = int(os.getenv('EXPORTER_SERIES_LIMIT')) if os.getenv('EXPORTER_SERIES_LIMIT') else (int(config.get('main', 'series_limit')) if config_exists and config.has_option('main', 'series_limit') else 0)
+EXPORTER_STATE_FILE = os.getenv('EXPORTER_STATE_FILE') if os.getenv('EXPORTER_STATE_FILE') else (config.get('main', 'state_file') if config_exists and config.has_option('main', 'state_file') else '/var/cache/salt-exporter/state.msgpack')
+EXPORTER_SCHEDULE = os.getenv('EXPORTER_SCHEDULE') if os.getenv('EXPORTER_SCHEDULE') else (config.get('main', 'schedule') if config_exists and config.has_option('main', 'schedule') else 'fixed')
+EXPORTER_KEYS_INTERVAL = int(os.getenv('EXPORTER_KEYS_INTERVAL')) if os.getenv('EXPORTER_KEYS_INTERVAL') else (int(config.get('main', 'keys_interval')) if config_exists and config.has_option('main', 'keys_interval') else 30)
+EXPORTER_JOBS_INTERVAL = int(os.getenv('EXPORTER_JOBS_INTERVAL')) if os.getenv('EXPORTER_JOBS_INTERVAL') else (int(config.get('main', 'jobs_interval')) if config_exists and config.has_option('main', 'jobs_interval') else 60)
+EXPORTER_PROBE_INTERVAL = int(os.getenv('EXPORTER_PROBE_INTERVAL')) if os.getenv('EXPORTER_PROBE_INTERVAL') else (int(config.get('main', 'probe_interval')) if config_exists and config.has_option('main', 'probe_interval') else 300)
+EXPORTER_VERSIONS_INTERVAL = int(os.getenv('EXPORTER_VERSIONS_INTERVAL')) if os.getenv('EXPORTER_VERSIONS_INTERVAL') else (int(config.get('main', 'versions_interval')) if config_exists and config.has_option('main', 'versions_interval') else 3600)
+EXPORTER_SCHEDULE_JITTER = float(os.getenv('EXPORTER_SCHEDULE_JITTER')) if os.getenv('EXPORTER_SCHEDULE_JITTER') else (float(config.get('main', 'schedule_jitter')) if config_exists and config.has_option('main', 'schedule_jitter') else 0.1)
+EXPORTER_RETURN_FETCHES = int(os.getenv('EXPORTER_RETURN_FETCHES')) if os.getenv('EXPORTER_RETURN_FETCHES') else (int(config.get('main', 'return_fetches')) if config_exists and config.has_option('main', 'return_fetches') else 4)
+EXPORTER_RELAY = os.getenv('EXPORTER_RELAY') == 'True' if os.getenv('EXPORTER_RELAY') else (config.get('main', 'relay_mode') == 'True' if config_exists and config.has_option('main', 'relay_mode') else False)
+EXPORTER_RELAY_INTERVAL = int(os.getenv('EXPORTER_RELAY_INTERVAL')) if os.getenv('EXPORTER_RELAY_INTERVAL') else (int(config.get('main', 'relay_interval')) if config_exists and config.has_option('main', 'relay_interval') else 10)
+EXPORTER_JOB_HISTORY_SIZE = int(os.getenv('EXPORTER_JOB_HISTORY_SIZE')) if os.getenv('EXPORTER_JOB_HISTORY_SIZE') else (int(config.get('main', 'job_history_size')) if config_exists and config.has_option('main', 'job_history_size') else 20)
+EXPORTER_JIDS_FILTER_RETURNERS = os.getenv('EXPORTER_JIDS_FILTER_RETURNERS').split(',') if os.getenv('EXPORTER_JIDS_FILTER_RETURNERS') else (config.get('main', 'jids_filter_returners').split(',') if config_exists and config.has_option('main', 'jids_filter_returners') else [])
+EXPORTER_JID_OVERLAP = int(os.getenv('EXPORTER_JID_OVERLAP')) if os.getenv('EXPORTER_JID_OVERLAP') else (int(config.get('main', 'jid_overlap')) if config_exists and config.has_option('main', 'jid_overlap') else 60)
 MASTER_HOSTNAME = socket.gethostname()
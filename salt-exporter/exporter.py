@@ -5,16 +5,26 @@ import sys
 import argparse
 import traceback
 import gc
-import json
 import asyncio
-import requests
-import subprocess
+import time
 from env import *
 from datetime import datetime
-from flask import Flask, request, jsonify
-from threading import Thread
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from modules.salt_master_local_client import salt_runner, salt_client, salt_key, salt_print_job, salt_list_jobs, master_version
+from collections import deque
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+from modules.salt_master_local_client import get_salt_runner, get_salt_key, get_salt_client, salt_print_job, salt_list_jobs, salt_job_minions, master_version, master_config, job_cache, dump_caches, load_caches
+from modules.event_collector import EventCollector, master_event_source
+from modules.jobs import FunctionClassifier, PROBE_METADATA
+from modules.history import JobHistory
+from modules.exposition import SnapshotCollector, start_metrics_server
+from modules.cardinality import JobDurationShaper, parse_duration_modes
+from modules.state import save_state, load_state
+from modules.samples import sample_types, compact
+from modules.scheduler import TieredScheduler
+from modules.aggregation import MultimasterAggregator
+from modules.receiver import AsyncReceiver, payload_source
+from modules.push import PushClient, CircuitBreaker, SequenceTracker, decode_body, is_full
+from modules.instrumentation import STAGE_DURATION, CYCLE_DURATION, LAST_SUCCESS, MINIONS_PROCESSED, JOB_QUEUE_DEPTH, JOBS_INGESTED, CYCLE_PEAK_RSS, SNAPSHOT_STALE, reset_peak_rss, peak_rss_bytes
 if EXPORTER_DEBUG:
     import tracemalloc
     import linecache
@@ -55,14 +65,12 @@ log.addHandler(handler)
 gc.enable()
 gc.set_debug(0)
 gc.set_threshold(700, 10, 10)
-
-
-def check_reachable(host: str):
-    return subprocess.call(f"ping -c 1 {host}".split(' '), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
-
-
-def check_port(host: str, port: int):
-    return subprocess.call(f"nc -zv {host} {port}".split(' '), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+try:
+    JOB_CLASSIFIER = FunctionClassifier(EXPORTER_EXCLUDED_FUNCTIONS, EXPORTER_INCLUDED_FUNCTIONS)
+    JOB_DURATION_MODES = parse_duration_modes(EXPORTER_JOB_DURATION_MODE)
+except ValueError as e:
+    log.error(f'Invalid configuration: {e}')
+    sys.exit(1)
 
 
 class SaltMetricsExporter:
@@ -114,6 +122,26 @@ class SaltMetricsExporter:
             'type': prom.Gauge,
             'labels': ['master', 'minion', 'fun']
         },
+        'salt_minion_job_failed_states': {
+            'desc': 'Number of failed states in the return of Salt job.',
+            'type': prom.Gauge,
+            'labels': ['master', 'minion', 'fun']
+        },
+        'salt_minion_job_failure_ratio': {
+            'desc': 'Share of failed jobs among the recent jobs of the minion.',
+            'type': prom.Gauge,
+            'labels': ['master', 'minion']
+        },
+        'salt_minion_last_highstate_success_timestamp_seconds': {
+            'desc': 'Unix time of the last successful highstate of the minion.',
+            'type': prom.Gauge,
+            'labels': ['master', 'minion']
+        },
+        'salt_function_recent_job_duration_seconds': {
+            'desc': 'Duration quantiles of the recent jobs of a function in seconds.',
+            'type': prom.Gauge,
+            'labels': ['master', 'fun', 'quantile']
+        },
         'salt_minion_status': {
             'desc': 'Status of salt-minion (0 - offline, 1 - online).',
             'type': prom.Gauge,
@@ -130,173 +158,302 @@ class SaltMetricsExporter:
             'labels': ['master', 'version']
         }
     }
+    SAMPLE_TYPES = sample_types(METRICS_INFO)
+    # Metrics every slave master sends, older versions included. Metrics added
+    # since default to no samples, so a rolling upgrade keeps merging.
+    REQUIRED_METRICS = frozenset((
+        'salt_all_jobs_total', 'salt_active_jobs_total', 'salt_minions_up_total', 'salt_minions_down_total',
+        'salt_minions_total', 'salt_accepted_minions_total', 'salt_denied_minions_total',
+        'salt_rejected_minions_total', 'salt_unaccepted_minions_total', 'salt_minion_job_duration_seconds',
+        'salt_minion_job_retcode', 'salt_minion_status', 'salt_minion_version', 'salt_master_version'
+    ))
 
     def __init__(self):
-        self.metrics = self._create_metrics()
+        self.collector = self._create_metrics()
         self.current_metrics = {}
-        self.received_metrics = {}
+        self.sequences = SequenceTracker()
+        self.aggregator = MultimasterAggregator(self.METRICS_INFO, MASTER_HOSTNAME, EXPORTER_SOURCE_TTL, on_expire=self.sequences.forget)
+        self.push_client = PushClient(
+            f'http://{EXPORTER_MAIN_MASTER_ADDR}:{EXPORTER_RECEIVER_PORT}',
+            self.METRICS_INFO,
+            {
+                "User-Agent": f"slave_master_{socket.gethostname().split('.')[0]}",
+                "X-Salt-Master": MASTER_HOSTNAME
+            },
+            full_every=EXPORTER_PUSH_FULL_EVERY,
+            timeout=EXPORTER_PUSH_TIMEOUT,
+            spool_size=EXPORTER_PUSH_SPOOL_SIZE,
+            breaker=CircuitBreaker(max_delay=EXPORTER_PUSH_BACKOFF_MAX)
+        )
+        self.active_jids = set()
+        self.active_since = ''
+        self.event_collector = None
+        self.publish_lock = Lock()
+        self.stage_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='stage')
+        self.stage_futures = {}
+        self.stage_results = {}
+        self.minion_versions = {}
+        self.minions_down = set()
+        self.version_probe_requested = True
+        self.versions_probed_at = 0
+        self.probe_targets = set()
+        self.state_saved_at = 0
+        self.gc_frozen = False
+        self.relay_pending = False
+        self.job_history = JobHistory(EXPORTER_JOB_HISTORY_SIZE, overlap=EXPORTER_JID_OVERLAP)
 
     def _create_metrics(self):
         log.info("Creating metrics...")
-        metrics = {}
+        collector = SnapshotCollector(self.METRICS_INFO, EXPORTER_SERIES_LIMIT)
+        self.duration_shaper = JobDurationShaper(JOB_DURATION_MODES, EXPORTER_JOB_DURATION_TOP_K, EXPORTER_SERIES_LIMIT)
+        log.info('Metrics created.')
+        return collector
+
+    def request_version_probe(self, minion: str = None):
+        self.version_probe_requested = True
+
+    def _iter_probe_returns(self, fun: str):
+        # Batches are published one after another: the next one goes out once
+        # every minion of the previous one has returned or after
+        # `probe_batch_timeout`, and every return is yielded as it arrives.
+        # Accepted minions that have not returned by the deadline are reported down.
+        client = get_salt_client()
+        targets = sorted(get_salt_key().list_keys().get('minions', []))
+        self.probe_targets = set(targets)
+        if EXPORTER_PROBE_BATCH_SIZE > 0:
+            batches = deque(
+                (targets[i:i + EXPORTER_PROBE_BATCH_SIZE], 'list')
+                for i in range(0, len(targets), EXPORTER_PROBE_BATCH_SIZE)
+            )
+        else:
+            batches = deque([('*', 'glob')])
+        deadline = time.monotonic() + EXPORTER_PROBE_DEADLINE
+        in_flight = []
+        pending = set()
+        settle_at = 0
         try:
-            for name, meta in self.METRICS_INFO.items():
-                metric_type = meta.get('type', prom.Gauge)
-                desc = meta.get('desc')
-                mode = meta.get('mode', 'single')
-                labels = meta.get('labels', None)
-                metrics.update({
-                    name: {
-                        'metric': metric_type(name, desc, labelnames=labels if labels else ()),
-                        'type': 'labeled' if labels else 'not_labeled',
-                        'mode': mode
-                    }
-                })
-            log.info('Metrics created.')
-            return metrics
-        except Exception:
-            log.error(f'Something went wrong when trying to create metrics: {traceback.format_exc()}')
-
-    def collect_data(self):
+            while batches or in_flight:
+                now = time.monotonic()
+                if now >= deadline:
+                    log.warning(f'Minion probe deadline of {EXPORTER_PROBE_DEADLINE}s reached, {len(batches)} batches not sent.')
+                    break
+                if batches and (not pending or now >= settle_at):
+                    tgt, tgt_type = batches.popleft()
+                    in_flight.append(client.cmd_iter_no_block(tgt, fun, tgt_type=tgt_type, expect_minions=True, metadata=PROBE_METADATA))
+                    pending = set(tgt) if tgt_type == 'list' else set()
+                    settle_at = now + EXPORTER_PROBE_BATCH_TIMEOUT
+                idle = True
+                for returns in list(in_flight):
+                    try:
+                        minion_return = next(returns)
+                    except StopIteration:
+                        in_flight.remove(returns)
+                        continue
+                    if minion_return:
+                        idle = False
+                        pending.difference_update(minion_return)
+                        yield minion_return
+                if idle:
+                    time.sleep(0.05)
+        finally:
+            for returns in in_flight:
+                returns.close()
+
+    def _probe_minions(self, refresh_versions: bool = False):
+        # One broadcast per cycle gives both status and version: test.version
+        # while some up minion has no cached version (new, back from down or
+        # restarted), otherwise the lighter test.ping with versions from cache.
+        # Without the event stream restarts go unnoticed, so the fixed schedule
+        # also asks versions every `versions_interval` (the tiered one has a
+        # signal of its own for that).
+        versions_due = EXPORTER_SCHEDULE != 'tiered' and time.monotonic() - self.versions_probed_at >= EXPORTER_VERSIONS_INTERVAL
+        fun = 'test.version' if self.version_probe_requested or refresh_versions or versions_due else 'test.ping'
+        self.version_probe_requested = False
+        if fun == 'test.version':
+            self.versions_probed_at = time.monotonic()
+        log.info(f'Probing minions with {fun}...')
+        minion_statuses = {
+            'up': [],
+            'down': []
+        }
+        versions = {}
+        seen = set()
+        for minion_return in self._iter_probe_returns(fun):
+            for m, data in minion_return.items():
+                if m in seen:
+                    continue
+                seen.add(m)
+                if isinstance(data, dict) and 'ret' in data and not data.get('failed') and data.get('out') != 'no_return':
+                    minion_statuses['up'].append(m)
+                    if fun == 'test.version':
+                        versions[m] = data['ret']
+                        continue
+                    if m in self.minion_versions:
+                        versions[m] = self.minion_versions[m]
+                    if m not in versions or m in self.minions_down:
+                        self.version_probe_requested = True
+                else:
+                    minion_statuses['down'].append(m)
+                    if m in self.minion_versions:
+                        versions[m] = self.minion_versions[m]
+        for m in self.probe_targets - seen:
+            minion_statuses['down'].append(m)
+            if m in self.minion_versions:
+                versions[m] = self.minion_versions[m]
+        self.minion_versions = versions
+        self.minions_down = set(minion_statuses['down'])
+        log.info(f'Probed {len(minion_statuses["up"])} up and {len(minion_statuses["down"])} down minions.')
+        return minion_statuses
+
+    def _collect_jobs(self):
+        log.info('Collecting jobs...')
+        start_time = datetime.today().replace(hour=0, minute=0, second=0)
+        end_time = datetime.today().replace(hour=23, minute=59, second=59)
+        job_list = salt_list_jobs(start_time=start_time, end_time=end_time)
+        log.info('Collected jobs.')
+
+        # Active jobs are collected after the job list, so every listed job
+        # that is still running shows up here and is not served from cache.
+        log.info('Collecting active jobs...')
+        active_since = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        active_jobs_list = get_salt_runner().cmd('jobs.active', print_event=EXPORTER_DEBUG)
+        log.info('Collected active jobs.')
+        return job_list, active_jobs_list, active_since
+
+    def _timed_stage(self, name: str, func):
+        with STAGE_DURATION.labels(name).time():
+            return func()
+
+    def _run_stages(self, stages: dict):
+        # Independent stages run concurrently, so a cycle takes about as long as
+        # its slowest stage. A stage that fails, times out or is still running
+        # from a previous cycle falls back to its last successful result.
+        futures = {}
+        for name, func in stages.items():
+            running = self.stage_futures.get(name)
+            if running and not running.done():
+                log.warning(f'Stage {name} is still running from a previous cycle.')
+                continue
+            futures[name] = self.stage_futures[name] = self.stage_executor.submit(self._timed_stage, name, func)
+
+        deadline = time.monotonic() + EXPORTER_STAGE_TIMEOUT
+        results = {}
+        for name in stages:
+            try:
+                if name not in futures:
+                    raise FutureTimeoutError()
+                results[name] = futures[name].result(timeout=max(0, deadline - time.monotonic()))
+                self.stage_results[name] = results[name]
+            except Exception:
+                if name not in self.stage_results:
+                    raise
+                log.error(f'Stage {name} failed, using its last result: {traceback.format_exc()}')
+                results[name] = self.stage_results[name]
+        return results
+
+    def collect_data(self, stages: dict = None):
+        # Without `stages` every signal is refreshed first (fixed schedule),
+        # otherwise the metrics are rebuilt from the given signal results.
         metrics = {
             'salt_minion_status': [],
             'salt_minion_job_duration_seconds': [],
             'salt_minion_job_retcode': [],
+            'salt_minion_job_failed_states': [],
+            'salt_minion_job_failure_ratio': [],
+            'salt_minion_last_highstate_success_timestamp_seconds': [],
             'salt_minion_version': []
         }
+        cycle_started = time.monotonic()
+        collected = False
+        reset_peak_rss()
         try:
             log.info('Starting collecting data...')
-            log.info('Collecting minion statuses...')
-            minion_statuses_return = salt_client.cmd('*', 'test.ping', full_return=True)
-            minion_statuses = {
-                'up': [],
-                'down': []
-            }
-            for m in minion_statuses_return:
-                if minion_statuses_return[m] and 'ret' in minion_statuses_return[m]:
-                    minion_statuses['up'].append(m)
-                else:
-                    minion_statuses['down'].append(m)
-            gc.collect()
-            log.info('Collected.')
-
-            log.info('Collecting jobs...')
-            start_time = datetime.today().replace(hour=0, minute=0, second=0).strftime("%Y, %b %d %H:%M:%S")
-            end_time = datetime.today().replace(hour=23, minute=59, second=59).strftime("%Y, %b %d %H:%M:%S")
-            job_list = salt_list_jobs(start_time=start_time, end_time=end_time)
-            job_list = dict(sorted(job_list.items(), reverse=True))
-            gc.collect()
-            log.info('Collected.')
-
-            log.info('Collecting active jobs...')
-            active_jobs_list = salt_runner.cmd('jobs.active', print_event=EXPORTER_DEBUG)
-            gc.collect()
-            log.info('Collected.')
-
-            log.info('Collecting versions of minions...')
-            minion_versions = salt_client.cmd('*', 'test.version', full_return=True)
-            gc.collect()
-            log.info(f'Collected.')
-
-            key_data = salt_key.list_keys()
+            if stages is None:
+                stages = self._run_stages({
+                    'statuses': self._probe_minions,
+                    'jobs': self._collect_jobs,
+                    'keys': lambda: get_salt_key().list_keys()
+                })
+            minion_statuses = stages['statuses']
+            job_list, active_jobs_list, active_since = stages['jobs']
+            active_jids = {str(jid) for jid in active_jobs_list}
+            key_data = stages['keys']
+            del stages
 
             minions_up = minion_statuses.get('up', [])
             minions_down = minion_statuses.get('down', [])
 
             log.info('Preparing down minions metric...')
-            down_metrics = [{'minion': m, 'value': 0} for m in minions_down]
+            status_sample = self.SAMPLE_TYPES['salt_minion_status']
+            down_metrics = [status_sample(m, 0) for m in minions_down]
             metrics['salt_minion_status'].extend(down_metrics)
             log.info('Prepared.')
 
             log.info('Preparing up minions metric...')
-            up_metrics = [{'minion': m, 'value': 1} for m in minions_up]
+            up_metrics = [status_sample(m, 1) for m in minions_up]
             metrics['salt_minion_status'].extend(up_metrics)
             log.info('Prepared.')
 
             log.info('Preparing minions versions metric...')
             minion_version_metric = [
-                {'minion': m, 'version': minion_versions[m]['ret'], 'value': 1}
-                for m in minion_versions
-                if minion_versions[m] and 'ret' in minion_versions[m]
+                self.SAMPLE_TYPES['salt_minion_version'](m, self.minion_versions[m], 1)
+                for m in minions_up
+                if m in self.minion_versions
             ]
             metrics['salt_minion_version'].extend(minion_version_metric)
             log.info('Prepared.')
 
             all_minions = minions_up + minions_down
 
-            def process_minion(minion):
-                matching_job_ids = (
-                    int(job_id) for job_id, details in job_list.items()
-                    if details.get('Target') == minion
-                    and not any(p.match(details.get('Function', '')) for p in EXCLUDED_PATTERNS)
-                    and any(p.match(details.get('Function', '')) for p in INCLUDED_PATTERNS)
-                )
-                try:
-                    last_job = max(matching_job_ids)
-                except ValueError:
-                    return None
-
-                last_job_details = salt_print_job(last_job)
-                if not last_job_details:
-                    return None
-
-                first_key = next(iter(last_job_details), None)
-                if first_key is None:
-                    return None
-
-                job_data = last_job_details[first_key]
-                fun = job_data.get('Function', '')
-                job_result = job_data.get('Result', {}).get(minion)
-
-                if not isinstance(job_result, dict) or not job_result:
-                    return None
-
-                if any(p.match(fun) for p in EXCLUDED_PATTERNS):
-                    return None
-
-                job_duration = 0
-                job_return = job_result.get('return')
-                if isinstance(job_return, dict):
-                    for val in job_return.values():
-                        if isinstance(val, dict):
-                            job_duration += val.get('duration', 0)
-                
-                del last_job_details, matching_job_ids, first_key
-                return {
-                    'job_duration': {
-                        'master': MASTER_HOSTNAME,
-                        'minion': minion,
-                        'jid': last_job,
-                        'fun': fun,
-                        'value': job_duration / 1000
-                    },
-                    'job_retcode': {
-                        'master': MASTER_HOSTNAME,
-                        'minion': minion,
-                        'fun': fun,
-                        'value': job_result.get('retcode')
-                    }
-                }
-
-            log.info('Preparing jobs metrics...')
-            with ThreadPoolExecutor(max_workers=25) as executor:
-                futures = {executor.submit(process_minion, minion): minion for minion in all_minions}
-                job_durations = []
-                job_retcodes = []
+            def ingest_job(jid):
+                JOB_QUEUE_DEPTH.dec()
+                job_details = salt_print_job(jid, active_jids).get(jid)
+                if not isinstance(job_details, dict) or not isinstance(job_details.get('Result'), dict):
+                    return
+                self.job_history.record(jid, job_details.get('Function', ''), job_details.get('Arguments'), job_details['Result'])
+                JOBS_INGESTED.inc()
+
+            log.info('Ingesting new jobs...')
+            with STAGE_DURATION.labels('history').time(), ThreadPoolExecutor(max_workers=25) as executor:
+                new_jids = self.job_history.new_jobs(job_list, active_jids, JOB_CLASSIFIER, salt_job_minions)
+                JOB_QUEUE_DEPTH.inc(len(new_jids))
+                futures = {executor.submit(ingest_job, jid): jid for jid in new_jids}
                 for future in as_completed(futures):
                     try:
-                        result = future.result()
-                        if result:
-                            job_durations.append(result['job_duration'])
-                            job_retcodes.append(result['job_retcode'])
+                        future.result()
                     except Exception:
-                        log.error(f'Error processing minion {futures[future]}: {traceback.format_exc()}')
-                metrics['salt_minion_job_duration_seconds'].extend(job_durations)
-                metrics['salt_minion_job_retcode'].extend(job_retcodes)
-                del job_durations, job_retcodes
+                        log.error(f'Error ingesting job {futures[future]}: {traceback.format_exc()}')
+            self.job_history.retain(all_minions)
+            log.info(f'Ingested {len(new_jids)} new jobs. Job cache hits: {job_cache.hits}, misses: {job_cache.misses}, size: {len(job_cache.jobs)}')
+
+            log.info('Preparing jobs metrics...')
+            duration_sample = self.SAMPLE_TYPES['salt_minion_job_duration_seconds']
+            retcode_sample = self.SAMPLE_TYPES['salt_minion_job_retcode']
+            failed_states_sample = self.SAMPLE_TYPES['salt_minion_job_failed_states']
+            failure_ratio_sample = self.SAMPLE_TYPES['salt_minion_job_failure_ratio']
+            highstate_sample = self.SAMPLE_TYPES['salt_minion_last_highstate_success_timestamp_seconds']
+            for minion, (jid, fun, duration, retcode, failed), failure_ratio, last_highstate in self.job_history.minion_stats():
+                metrics['salt_minion_job_duration_seconds'].append(duration_sample(MASTER_HOSTNAME, minion, jid, fun, duration))
+                metrics['salt_minion_job_retcode'].append(retcode_sample(MASTER_HOSTNAME, minion, fun, retcode))
+                metrics['salt_minion_job_failed_states'].append(failed_states_sample(MASTER_HOSTNAME, minion, fun, failed))
+                metrics['salt_minion_job_failure_ratio'].append(failure_ratio_sample(MASTER_HOSTNAME, minion, failure_ratio))
+                if last_highstate:
+                    metrics['salt_minion_last_highstate_success_timestamp_seconds'].append(highstate_sample(MASTER_HOSTNAME, minion, last_highstate))
+            quantile_sample = self.SAMPLE_TYPES['salt_function_recent_job_duration_seconds']
+            metrics['salt_function_recent_job_duration_seconds'] = [
+                quantile_sample(MASTER_HOSTNAME, fun, str(q), value)
+                for fun, quantiles in self.job_history.duration_quantiles().items()
+                for q, value in quantiles.items()
+            ]
+            MINIONS_PROCESSED.inc(len(all_minions))
             log.info('Prepared.')
 
             log.info('All data collected and prepared successfully!')
+            self.active_jids = active_jids
+            self.active_since = active_since
+            LAST_SUCCESS.set_to_current_time()
+            SNAPSHOT_STALE.set(0)
+            collected = True
             metrics.update({
                 'salt_all_jobs_total': {'value': len(job_list)},
                 'salt_active_jobs_total': {'value': len(active_jobs_list)},
@@ -307,110 +464,157 @@ class SaltMetricsExporter:
                 'salt_denied_minions_total': {'value': len(key_data.get('minions_denied', []))},
                 'salt_rejected_minions_total': {'value': len(key_data.get('minions_rejected', []))},
                 'salt_unaccepted_minions_total': {'value': len(key_data.get('minions_pre', []))},
-                'salt_master_version': [{'master': MASTER_HOSTNAME, 'version': master_version, 'value': 1}]
+                'salt_master_version': [self.SAMPLE_TYPES['salt_master_version'](MASTER_HOSTNAME, master_version, 1)]
             })
 
-            del minion_statuses, minion_statuses_return, job_list, active_jobs_list, minions_up, minions_down, all_minions, key_data, down_metrics, up_metrics, minion_version_metric, minion_versions
+            del minion_statuses, job_list, active_jobs_list, active_jids, minions_up, minions_down, all_minions, key_data, down_metrics, up_metrics, minion_version_metric, status_sample
 
         except Exception:
             log.error(f'Something went wrong when trying to collect and prepare metrics data: {traceback.format_exc()}')
             if self.current_metrics:
-                metrics.clear()
-                metrics.update(self.current_metrics)
+                metrics = dict(self.current_metrics)
 
         if EXPORTER_DEBUG:
             log.debug(f'Collected metrics: {metrics}')
 
-        if self.current_metrics:
-            self.current_metrics.clear()
-        self.current_metrics.update(metrics)
+        # Swapped, never changed in place: the push spool and the retry thread
+        # keep references to earlier snapshots.
+        self.current_metrics = metrics
         del metrics
+        if collected and not self.gc_frozen:
+            # The Salt clients and their loaders are built on first use, in the
+            # first successful cycle, and live for the whole process from then
+            # on: keep them out of every following collection.
+            gc.collect()
+            gc.freeze()
+            self.gc_frozen = True
+        else:
+            gc.collect(1)
+        CYCLE_DURATION.observe(time.monotonic() - cycle_started)
+        CYCLE_PEAK_RSS.set(peak_rss_bytes())
+        if EXPORTER_STATE_FILE and time.monotonic() - self.state_saved_at >= EXPORTER_COLLECT_DELAY:
+            self.save_state_snapshot()
+
+    def save_state_snapshot(self):
+        try:
+            with STAGE_DURATION.labels('snapshot').time():
+                size = save_state(EXPORTER_STATE_FILE, {
+                    'metrics': self.current_metrics,
+                    'minion_versions': self.minion_versions,
+                    'minions_down': list(self.minions_down),
+                    'caches': dump_caches(),
+                    'history': self.job_history.dump()
+                })
+            self.state_saved_at = time.monotonic()
+            log.info(f'State snapshot saved to {EXPORTER_STATE_FILE} ({size} bytes).')
+        except Exception:
+            log.error(f'Something went wrong when trying to save state snapshot: {traceback.format_exc()}')
+
+    def restore_state_snapshot(self):
+        # Metrics of the previous run are served right away and flagged stale
+        # until the first fresh cycle; the restored caches keep that cycle
+        # incremental (known jobs, cached results and versions).
+        try:
+            state, saved = load_state(EXPORTER_STATE_FILE)
+            if not state:
+                return False
+            load_caches(state['caches'])
+            if 'history' in state:
+                self.job_history.load(state['history'])
+            self.minion_versions = state['minion_versions']
+            self.minions_down = set(state['minions_down'])
+            self.version_probe_requested = False
+            self.versions_probed_at = time.monotonic()
+            self.current_metrics = compact(state['metrics'], self.SAMPLE_TYPES)
+        except Exception:
+            log.error(f'Something went wrong when trying to restore state snapshot: {traceback.format_exc()}')
+            return False
+        SNAPSHOT_STALE.set(1)
+        log.info(f'State snapshot from {datetime.fromtimestamp(saved)} restored, metrics are stale until the first cycle.')
+        self.publish_metrics()
+        return True
 
     def update_metrics(self, counts: dict):
         log.info('Updating metrics...')
-
-        def _set_or_observe(metric_obj, value):
-            if isinstance(metric_obj, prom.Gauge):
-                metric_obj.set(value)
-            else:
-                metric_obj.observe(value)
-
         try:
-            for key, value in counts.items():
-                metric = self.metrics.get(key)
-                if metric is None:
-                    continue
-                if metric['type'] == 'not_labeled':
-                    _set_or_observe(metric['metric'], value['value'])
-                else:
-                    if metric['mode'] == 'single':
-                        metric['metric'].clear()
-                    for metric_data in value:
-                        _set_or_observe(metric['metric'].labels(**{k: v for k, v in metric_data.items() if k not in ('value')}), metric_data['value'])
-                del metric
+            shaped, families = self.duration_shaper.shape(counts)
+            self.collector.update(shaped, families)
             log.info('Metrics updated.')
         except Exception:
             log.error(f'Something went wrong when trying to update metrics data: {traceback.format_exc()}')
         del counts
 
-    def send_data_to_main(self, counts: dict):
-        _headers = {
-            "Content-Type": "application/json",
-            "User-Agent": f"slave_master_{socket.gethostname().split('.')[0]}"
-        }
+    def send_data_to_main(self, counts: dict = None):
+        # Returns False when the snapshot stays spooled for a later retry.
         try:
-            response = requests.post(f'http://{EXPORTER_MAIN_MASTER_ADDR}:{EXPORTER_RECEIVER_PORT}', headers=_headers, data=json.dumps(counts), verify=False)
+            if counts is None:
+                response = self.push_client.flush()
+            else:
+                response = self.push_client.submit(counts)
+            if response is None:
+                log.debug(f'Main master {EXPORTER_MAIN_MASTER_ADDR} unavailable, {len(self.push_client.spool)} snapshots spooled')
+                return False
             log.info(f'Data sent to main master server {EXPORTER_MAIN_MASTER_ADDR}, response: {response.status_code} - {response.text}')
-            del counts, response
+            return response.status_code in (200, 202)
         except Exception:
             log.error(f'Something went wrong when trying to sent metrics data to main master server: {traceback.format_exc()}')
-
-    def merge_metrics(self, main: dict, received: dict):
-        merged = main.copy()
-
-        for key in ['salt_active_jobs_total', 'salt_all_jobs_total', 'salt_minions_down_total']:
-            val1 = merged.get(key, {}).get('value', 0)
-            val2 = received.get(key, {}).get('value', 0)
-            merged[key] = {'value': val1 + val2}
-
-        total_minions = merged.get('salt_minions_total', {}).get('value', 0)
-        minions_up_1 = merged.get('salt_minions_up_total', {}).get('value', 0)
-        minions_up_2 = received.get('salt_minions_up_total', {}).get('value', 0)
-
-        merged['salt_minions_down_total'] = {
-            'value': total_minions - (minions_up_1 + minions_up_2)
-        }
-
-        merged['salt_minions_up_total'] = {
-            'value': minions_up_1 + minions_up_2
-        }
-
-        merged['salt_minion_job_duration_seconds'].extend(received['salt_minion_job_duration_seconds'])
-        merged['salt_minion_job_retcode'].extend(received['salt_minion_job_retcode'])
-        merged['salt_minion_version'].extend(received['salt_minion_version'])
-        merged['salt_master_version'].extend(received['salt_master_version'])
-
-        main_status_map = {
-            item['minion']: {'value': item['value']}
-            for item in merged.get('salt_minion_status', [])
-        }
-        counts_status_map = {
-            item['minion']: {'value': item['value']}
-            for item in received.get('salt_minion_status', [])
-        }
-
-        for minion, counts_data in counts_status_map.items():
-            main_data = main_status_map.get(minion)
-            if main_data and counts_data['value'] != main_data['value']:
-                main_status_map[minion]['value'] = 1
-
-        merged['salt_minion_status'] = [
-            {'minion': minion, 'value': data['value']}
-            for minion, data in main_status_map.items()
-        ]
-
-        del main_status_map, counts_status_map, received, main
-        return merged
+            return False
+
+    def run_push_retry(self):
+        # Replays the newest spooled snapshot as soon as the breaker lets a
+        # probe through instead of waiting for the next collection cycle.
+        while True:
+            time.sleep(max(1, self.push_client.breaker.retry_in()))
+            if self.push_client.spool:
+                with self.publish_lock:
+                    self.send_data_to_main()
+
+    def run_relay(self):
+        # Relay masters forward the merged view of their region upstream, at
+        # most once per `relay_interval` however many downstream masters push.
+        # The upstream receiver merges it as a single source: minion samples
+        # are already de-duplicated, job counters summed and minion counters
+        # derived from the merged statuses.
+        while True:
+            time.sleep(EXPORTER_RELAY_INTERVAL)
+            if self.relay_pending:
+                with self.publish_lock:
+                    self.relay_pending = False
+                    self.send_data_to_main(self.aggregator.merged())
+
+    def merge_metrics(self, source: str, counts: dict):
+        self.aggregator.update(source, counts)
+        return self.aggregator.merged()
+
+    def publish_metrics(self):
+        with self.publish_lock:
+            if not EXPORTER_MULTIMASTER_ENABLED:
+                self.update_metrics(self.current_metrics)
+            else:
+                if EXPORTER_MAIN_MASTER or EXPORTER_RELAY:
+                    self.update_metrics(self.merge_metrics(MASTER_HOSTNAME, self.current_metrics))
+                    self.relay_pending = EXPORTER_RELAY
+                else:
+                    if not self.send_data_to_main(self.current_metrics):
+                        self.update_metrics(self.current_metrics)
+
+    def publish_streamed_metrics(self, collector: EventCollector):
+        self.current_metrics = collector.snapshot(self.current_metrics)
+        self.publish_metrics()
+
+    def run_event_collector(self, source=None):
+        # Streaming mode: job returns, new jobs and minion starts are applied as
+        # they arrive on the event bus, polling only reconciles the state.
+        self.event_collector = EventCollector(
+            source if source is not None else master_event_source(master_config),
+            self.publish_streamed_metrics,
+            JOB_CLASSIFIER,
+            MASTER_HOSTNAME,
+            on_minion_start=self.request_version_probe
+        )
+        thread = Thread(target=self.event_collector.run, daemon=True)
+        thread.start()
+        return thread
 
     async def run(self, addr: str = None, port: int = None, delay: int = None):
         addr = addr or EXPORTER_ADDR
@@ -418,77 +622,113 @@ class SaltMetricsExporter:
         delay = delay or EXPORTER_COLLECT_DELAY
 
         if EXPORTER_MAIN_MASTER:
-            prom.start_http_server(port, addr=addr)
+            start_metrics_server(port, addr, self.collector)
             log.info(f"Exporter started on {addr}:{port}")
+        elif EXPORTER_MULTIMASTER_ENABLED:
+            # Slave masters expose their own metrics and push health, which
+            # carry the local data while the main master is unavailable.
+            start_metrics_server(port, addr, self.collector)
+            log.info(f"Exporter started on {addr}:{port}")
+            Thread(target=self.run_push_retry, daemon=True).start()
+            if EXPORTER_RELAY:
+                Thread(target=self.run_relay, daemon=True).start()
+
+        if EXPORTER_STATE_FILE:
+            self.restore_state_snapshot()
+
+        if EXPORTER_EVENT_STREAM:
+            self.run_event_collector()
 
         async def run_metrics_collector(delay):
             while True:
                 self.collect_data()
-                if not EXPORTER_MULTIMASTER_ENABLED:
-                    self.update_metrics(self.current_metrics)
-                else:
-                    if EXPORTER_MAIN_MASTER:
-                        if self.received_metrics:
-                            self.update_metrics(self.merge_metrics(self.current_metrics, self.received_metrics))
-                        else:
-                            self.update_metrics(self.current_metrics)
-                    else:
-                        main_reachable = check_reachable(EXPORTER_MAIN_MASTER_ADDR)
-                        port_open = check_port(EXPORTER_MAIN_MASTER_ADDR, EXPORTER_RECEIVER_PORT)
-                        log.debug(f'Main master reachable {main_reachable} and port open {port_open}')
-                        if main_reachable and port_open:
-                            self.send_data_to_main(self.current_metrics)
-                        else:
-                            self.update_metrics(self.current_metrics)
-                if EXPORTER_DEBUG:
-                    snapshot = tracemalloc.take_snapshot()
-                    display_top(snapshot)
-                    del snapshot
+                self.refresh_published()
                 await asyncio.sleep(delay)
 
-        thread = Thread(target=lambda: asyncio.run(run_metrics_collector(delay)), daemon=True)
+        if EXPORTER_SCHEDULE == 'tiered':
+            thread = Thread(target=self.create_scheduler().run, daemon=True)
+        else:
+            thread = Thread(target=lambda: asyncio.run(run_metrics_collector(delay)), daemon=True)
         thread.start()
         while thread.is_alive():
             await asyncio.sleep(1)
 
-    async def run_receiver(self, addr: str = None, port: int = None):
-
-        def create_flask_app():
-            app = Flask(__name__)
-
-            @app.route('/', methods=['POST'])
-            def _handle_post():
-                data = request.get_json()
-                if not data:
-                    del data
-                    return jsonify({'error': 'No JSON received'}), 400
-                if sorted(data.keys()) != sorted(self.METRICS_INFO.keys()):
-                    del data
-                    return jsonify({'error': 'Invalid metric data provided'}), 400
-                if self.received_metrics:
-                    self.received_metrics.clear()
-                self.received_metrics.update(data)
-                if self.current_metrics:
-                    self.update_metrics(self.merge_metrics(self.current_metrics, self.received_metrics))
-
-                del data
-                return jsonify({'success': 'Data added successfully'}), 200
-
-            return app
+    def refresh_published(self):
+        if self.event_collector:
+            # Streamed job results newer than the poll are kept by reconcile
+            # and must be published with it.
+            self.current_metrics = self.event_collector.reconcile(self.current_metrics, self.active_jids, self.active_since)
+        self.publish_metrics()
+        if EXPORTER_DEBUG:
+            snapshot = tracemalloc.take_snapshot()
+            display_top(snapshot)
+            del snapshot
+
+    def create_scheduler(self):
+        # Tiered schedule: cheap, fast-changing signals are refreshed often and
+        # the broadcasts rarely. The version probe also refreshes the statuses,
+        # so both write the same result; the first probe already asks versions.
+        scheduler = TieredScheduler(self.stage_executor, self.on_signals_refreshed)
+        scheduler.add('keys', lambda: get_salt_key().list_keys(), EXPORTER_KEYS_INTERVAL, EXPORTER_SCHEDULE_JITTER)
+        scheduler.add('jobs', self._collect_jobs, EXPORTER_JOBS_INTERVAL, EXPORTER_SCHEDULE_JITTER)
+        scheduler.add('statuses', self._probe_minions, EXPORTER_PROBE_INTERVAL, EXPORTER_SCHEDULE_JITTER)
+        scheduler.add('versions', lambda: self._probe_minions(refresh_versions=True), EXPORTER_VERSIONS_INTERVAL, EXPORTER_SCHEDULE_JITTER,
+                      result_key='statuses', delay=EXPORTER_VERSIONS_INTERVAL)
+        self.scheduler = scheduler
+        return scheduler
+
+    def on_signals_refreshed(self, signals: list):
+        results = self.scheduler.results
+        if not {'statuses', 'jobs', 'keys'} <= results.keys():
+            return
+        log.info(f'Signals refreshed: {", ".join(signals)}')
+        self.collect_data(dict(results))
+        self.refresh_published()
+
+    def _apply_payload(self, source: str, headers: dict, body: bytes):
+        try:
+            data = decode_body(headers, body)
+        except (OSError, ValueError):
+            log.error(f'Invalid payload received from {source}.')
+            return
+        if not is_full(headers):
+            if not self.aggregator.patch(source, data.get('counters', {}), data.get('upsert', {}), data.get('remove', {})):
+                log.error(f'Delta received from {source} without a full payload to apply it to, a full resync is requested.')
+                self.sequences.forget(source)
+            return
+        if not isinstance(data, dict) or not self.REQUIRED_METRICS <= data.keys():
+            log.error(f'Invalid metric data received from {source}.')
+            return
+        # Metrics unknown to this version (sent by a newer slave) are ignored.
+        data = {
+            name: data.get(name, [] if meta.get('labels') else {'value': 0})
+            for name, meta in self.METRICS_INFO.items()
+        }
+        self.aggregator.update(source, data)
+
+    def apply_received(self, batch: list):
+        # Deltas must be applied in order, but everything a source sent before
+        # its latest full payload in this batch can be skipped.
+        by_source = {}
+        for headers, body, _ in batch:
+            by_source.setdefault(payload_source(headers), []).append((headers, body))
+        for source, payloads in by_source.items():
+            start = max((i for i, (headers, _) in enumerate(payloads) if is_full(headers)), default=0)
+            for headers, body in payloads[start:]:
+                self._apply_payload(source, headers, body)
+        if self.current_metrics:
+            with self.publish_lock:
+                self.update_metrics(self.aggregator.merged())
+                self.relay_pending = EXPORTER_RELAY
+        log.info(f'Merged {len(batch)} received payloads from {len(by_source)} masters.')
 
+    async def run_receiver(self, addr: str = None, port: int = None):
         addr = addr or EXPORTER_ADDR
         port = port or EXPORTER_RECEIVER_PORT
 
-        app = create_flask_app()
-
-        def run_flask():
-            app.run(host=addr, port=port)
-
-        thread = Thread(target=run_flask, daemon=True)
-        thread.start()
+        receiver = AsyncReceiver(self.apply_received, sequences=self.sequences)
         log.info(f"Receiver server started on {addr}:{port}")
-        while thread.is_alive():
-            await asyncio.sleep(1)
+        await receiver.serve(addr, port)
 
 
 if __name__ == '__main__':
@@ -520,18 +760,24 @@ if __name__ == '__main__':
         log.info(f'Metrics server port: tcp/{EXPORTER_PORT}')
         log.info(f'Receiver server port: tcp/{EXPORTER_RECEIVER_PORT}')
         log.info(f'Collect delay: {EXPORTER_COLLECT_DELAY} seconds')
+        log.info(f'Schedule: {EXPORTER_SCHEDULE}')
         log.info(f'Debug enabled: {EXPORTER_DEBUG}')
         log.info(f'Is it main master?: {EXPORTER_MAIN_MASTER}')
         log.info(f'Main master addr: {EXPORTER_MAIN_MASTER_ADDR}')
-        log.info(f'Main master reachable: {check_reachable(EXPORTER_MAIN_MASTER_ADDR)}')
         log.info(f'Multimaster mode enabled: {EXPORTER_MULTIMASTER_ENABLED}')
+        log.info(f'Relay mode enabled: {EXPORTER_RELAY}')
+        log.info(f'Event stream enabled: {EXPORTER_EVENT_STREAM}')
+        log.info(f'Job duration mode: {",".join(sorted(JOB_DURATION_MODES))}')
         log.info(f'Included functions: {EXPORTER_INCLUDED_FUNCTIONS}')
         log.info(f'Excluded functions: {EXPORTER_EXCLUDED_FUNCTIONS}')
         log.info('==================================================================')
         exporter = SaltMetricsExporter()
         loop = asyncio.get_event_loop()
         tasks = []
-        if EXPORTER_MAIN_MASTER and EXPORTER_MULTIMASTER_ENABLED:
+        if EXPORTER_RELAY and (EXPORTER_MAIN_MASTER or not EXPORTER_MULTIMASTER_ENABLED):
+            log.error('Relay mode requires multimaster mode on a master that is not the main one.')
+            sys.exit(1)
+        if EXPORTER_MULTIMASTER_ENABLED and (EXPORTER_MAIN_MASTER or EXPORTER_RELAY):
             tasks.append(exporter.run_receiver(args.addr, args.rport))
         tasks.append(exporter.run(args.addr, args.port, args.delay))
         if EXPORTER_DEBUG:
@@ -0,0 +1,153 @@
+import time
+import threading
+from modules.samples import sample_type, sample_types
+
+STATUS_METRIC = 'salt_minion_status'
+SUMMED_METRICS = ('salt_all_jobs_total', 'salt_active_jobs_total')
+DERIVED_METRICS = ('salt_minions_total', 'salt_minions_up_total', 'salt_minions_down_total')
+
+
+class SourceState:
+    __slots__ = ('counters', 'samples', 'statuses', 'updated')
+
+    def __init__(self):
+        self.counters = {}
+        self.samples = {}
+        self.statuses = {}
+        self.updated = 0
+
+
+class MultimasterAggregator:
+    # Keeps the latest payload of every master separately and maintains the
+    # merged view incrementally: an update only touches the samples that the
+    # source added, changed or dropped since its previous payload, so
+    # replaying the same payload changes nothing.
+    #
+    # Labeled samples are unioned (a sample reported by several masters stays
+    # until the last of them drops it), minion status is up if any master
+    # sees the minion up, job counters are summed and the remaining counters
+    # come from the local master. `on_expire` is called with every source
+    # dropped after `ttl` seconds without a payload.
+    def __init__(self, metrics_info: dict, local: str, ttl: int, on_expire=None):
+        self.local = local
+        self.ttl = ttl
+        self.on_expire = on_expire
+        self.labels = {
+            name: tuple(meta['labels']) for name, meta in metrics_info.items()
+            if meta.get('labels') and name != STATUS_METRIC
+        }
+        self.sample_types = sample_types(metrics_info)
+        self.status_sample = sample_type(('minion',))
+        self.sources = {}
+        self.samples = {name: {} for name in self.labels}
+        self.statuses = {}
+        self.lock = threading.Lock()
+
+    def _apply(self, source: str, merged: dict, old: dict, new: dict):
+        for key in old.keys() - new.keys():
+            owners = merged[key]
+            del owners[source]
+            if not owners:
+                del merged[key]
+        for key, value in new.items():
+            if key not in old or old[key] != value:
+                merged.setdefault(key, {})[source] = value
+
+    def _replace(self, source: str, state: SourceState, counts: dict):
+        for name, labels in self.labels.items():
+            new = {
+                tuple(str(sample.get(label, '')) for label in labels): sample['value']
+                for sample in counts.get(name, [])
+            }
+            self._apply(source, self.samples[name], state.samples.get(name, {}), new)
+            state.samples[name] = new
+        statuses = {sample['minion']: sample['value'] for sample in counts.get(STATUS_METRIC, [])}
+        self._apply(source, self.statuses, state.statuses, statuses)
+        state.statuses = statuses
+        state.counters = {
+            name: value['value'] for name, value in counts.items()
+            if isinstance(value, dict) and 'value' in value
+        }
+
+    def _expire(self, now: float):
+        for source, state in list(self.sources.items()):
+            if source != self.local and now - state.updated > self.ttl:
+                self._replace(source, state, {})
+                del self.sources[source]
+                if self.on_expire:
+                    self.on_expire(source)
+
+    def update(self, source: str, counts: dict):
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            state = self.sources.get(source)
+            if state is None:
+                state = self.sources[source] = SourceState()
+            self._replace(source, state, counts)
+            state.updated = now
+
+    def patch(self, source: str, counters: dict, upsert: dict, remove: dict):
+        # Applies a delta on top of the source's previous payload. Returns False
+        # when there is nothing to patch and a full payload is needed.
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            state = self.sources.get(source)
+            if state is None:
+                return False
+            for name in upsert.keys() | remove.keys():
+                if name == STATUS_METRIC:
+                    labels, own, merged = ('minion',), state.statuses, self.statuses
+                elif name in self.labels:
+                    labels, own, merged = self.labels[name], state.samples.setdefault(name, {}), self.samples[name]
+                else:
+                    continue
+                new = {}
+                for sample in upsert.get(name, []):
+                    key = tuple(str(sample.get(label, '')) for label in labels)
+                    new[key[0] if name == STATUS_METRIC else key] = sample['value']
+                removed = {key[0] if name == STATUS_METRIC else tuple(key) for key in remove.get(name, [])}
+                old = {key: own[key] for key in new.keys() | removed if key in own}
+                current = {key: value for key, value in old.items() if key not in removed}
+                current.update(new)
+                self._apply(source, merged, old, current)
+                for key in removed:
+                    own.pop(key, None)
+                own.update(new)
+            state.counters.update({
+                name: value['value'] for name, value in counters.items()
+                if isinstance(value, dict) and 'value' in value
+            })
+            state.updated = now
+            return True
+
+    def merged(self):
+        with self.lock:
+            self._expire(time.time())
+            ret = {}
+            for name in self.labels:
+                sample = self.sample_types[name]
+                ret[name] = [
+                    sample(*key, next(reversed(owners.values())))
+                    for key, owners in self.samples[name].items()
+                ]
+            ret[STATUS_METRIC] = [
+                self.status_sample(minion, max(owners.values()))
+                for minion, owners in self.statuses.items()
+            ]
+            up = sum(1 for item in ret[STATUS_METRIC] if item['value'] == 1)
+            ret['salt_minions_total'] = {'value': len(self.statuses)}
+            ret['salt_minions_up_total'] = {'value': up}
+            ret['salt_minions_down_total'] = {'value': len(self.statuses) - up}
+
+            local = self.sources.get(self.local)
+            for state in self.sources.values():
+                for name, value in state.counters.items():
+                    if name in DERIVED_METRICS:
+                        continue
+                    if name in SUMMED_METRICS:
+                        ret[name] = {'value': ret.get(name, {}).get('value', 0) + value}
+                    elif name not in ret or state is local:
+                        ret[name] = {'value': value}
+            return ret
@@ -0,0 +1,137 @@
+import heapq
+from prometheus_client.metrics_core import Metric
+from modules.instrumentation import SERIES_DROPPED
+
+DURATION_METRIC = 'salt_minion_job_duration_seconds'
+FUNCTION_METRIC = 'salt_function_job_duration_seconds'
+TOP_METRIC = 'salt_slowest_job_duration_seconds'
+DURATION_MODES = ('jid', 'minion', 'histogram', 'summary', 'topk')
+DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, float('inf'))
+
+
+def parse_duration_modes(value: str):
+    modes = {mode.strip() for mode in value.split(',') if mode.strip()}
+    unknown = modes - set(DURATION_MODES)
+    if unknown:
+        raise ValueError(f'Unknown job duration modes {sorted(unknown)} in job_duration_mode, expected {list(DURATION_MODES)}')
+    if {'jid', 'minion'} <= modes:
+        raise ValueError('job_duration_mode can contain only one of jid and minion')
+    if {'histogram', 'summary'} <= modes:
+        raise ValueError('job_duration_mode can contain only one of histogram and summary')
+    return modes
+
+
+class FunctionDurations:
+    __slots__ = ('buckets', 'count', 'sum')
+
+    def __init__(self, buckets: int):
+        self.buckets = [0] * buckets
+        self.count = 0
+        self.sum = 0.0
+
+
+class JobDurationShaper:
+    # Turns the per-minion job durations into the series selected by the
+    # job duration modes:
+    #   jid       - per-minion gauge labeled by jid (a new series per job)
+    #   minion    - the same gauge without the jid label
+    #   histogram - per-function histogram across minions, no minion or jid
+    #   summary   - per-function count and sum across minions
+    #   topk      - gauge of the `top_k` slowest current jobs
+    # Histogram and summary are cumulative: a job is observed once, when it
+    # first shows up as the latest job of a minion. `series_limit` caps the
+    # functions tracked and the minion gauge like the other labeled metrics.
+    def __init__(self, modes: set, top_k: int = 10, series_limit: int = 0, buckets: tuple = DURATION_BUCKETS):
+        self.modes = modes
+        self.top_k = top_k
+        self.series_limit = series_limit
+        self.buckets = buckets
+        self.latest = {}
+        self.functions = {}
+
+    def _observe(self, samples: list):
+        latest = {}
+        for sample in samples:
+            key = (sample.get('master', ''), sample.get('minion', ''))
+            jid = str(sample.get('jid', ''))
+            latest[key] = jid
+            if self.latest.get(key) == jid or sample.get('value') is None:
+                continue
+            value = sample['value']
+            fun = str(sample.get('fun', ''))
+            durations = self.functions.get(fun)
+            if durations is None:
+                if self.series_limit and len(self.functions) >= self.series_limit:
+                    SERIES_DROPPED.labels(FUNCTION_METRIC).inc()
+                    continue
+                durations = self.functions[fun] = FunctionDurations(len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    durations.buckets[i] += 1
+                    break
+            durations.count += 1
+            durations.sum += value
+        # Minions that no longer report are forgotten, keeping this bounded.
+        self.latest = latest
+
+    def _function_family(self, desc: str):
+        if 'histogram' in self.modes:
+            family = Metric(FUNCTION_METRIC, desc, 'histogram')
+            for fun, durations in self.functions.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, durations.buckets):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else str(float(bound))
+                    family.add_sample(f'{FUNCTION_METRIC}_bucket', {'fun': fun, 'le': le}, cumulative)
+                family.add_sample(f'{FUNCTION_METRIC}_count', {'fun': fun}, durations.count)
+                family.add_sample(f'{FUNCTION_METRIC}_sum', {'fun': fun}, durations.sum)
+        else:
+            family = Metric(FUNCTION_METRIC, desc, 'summary')
+            for fun, durations in self.functions.items():
+                family.add_sample(f'{FUNCTION_METRIC}_count', {'fun': fun}, durations.count)
+                family.add_sample(f'{FUNCTION_METRIC}_sum', {'fun': fun}, durations.sum)
+        return family
+
+    def shape(self, counts: dict):
+        # Returns the counts without the raw duration samples and the extra
+        # metric families to expose instead of them.
+        samples = counts.get(DURATION_METRIC)
+        if samples is None:
+            return counts, []
+        shaped = {name: value for name, value in counts.items() if name != DURATION_METRIC}
+        families = []
+        if 'jid' in self.modes:
+            shaped[DURATION_METRIC] = samples
+        if 'minion' in self.modes:
+            family = Metric(DURATION_METRIC, 'Duration of the latest Salt job of a minion in seconds.', 'gauge')
+            for sample in samples:
+                if sample.get('value') is None:
+                    continue
+                if self.series_limit and len(family.samples) >= self.series_limit:
+                    SERIES_DROPPED.labels(DURATION_METRIC).inc()
+                    continue
+                family.add_sample(DURATION_METRIC, {
+                    'master': str(sample.get('master', '')),
+                    'minion': str(sample.get('minion', '')),
+                    'fun': str(sample.get('fun', ''))
+                }, sample['value'])
+            families.append(family)
+        if 'histogram' in self.modes or 'summary' in self.modes:
+            self._observe(samples)
+            families.append(self._function_family('Duration of Salt jobs by function in seconds.'))
+        if 'topk' in self.modes:
+            family = Metric(TOP_METRIC, f'Duration of the {self.top_k} slowest latest Salt jobs in seconds.', 'gauge')
+            slowest = heapq.nlargest(
+                self.top_k,
+                (sample for sample in samples if sample.get('value') is not None),
+                key=lambda sample: sample['value']
+            )
+            for sample in slowest:
+                family.add_sample(TOP_METRIC, {
+                    'master': str(sample.get('master', '')),
+                    'minion': str(sample.get('minion', '')),
+                    'jid': str(sample.get('jid', '')),
+                    'fun': str(sample.get('fun', ''))
+                }, sample['value'])
+            families.append(family)
+        return shaped, families
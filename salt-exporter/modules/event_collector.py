@@ -0,0 +1,190 @@
+import json
+import time
+import logging
+import threading
+import traceback
+from modules.jobs import summarize_return, is_probe
+from modules.samples import sample_type
+
+log = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 5
+DURATION_SAMPLE = sample_type(('master', 'minion', 'jid', 'fun'))
+RETCODE_SAMPLE = sample_type(('master', 'minion', 'fun'))
+FAILED_STATES_SAMPLE = sample_type(('master', 'minion', 'fun'))
+STATUS_SAMPLE = sample_type(('minion',))
+
+
+def master_event_source(opts):
+    # Yields (tag, data) for every event on the master bus and None when the bus
+    # was idle for a second, so the consumer still gets a chance to flush.
+    import salt.utils.event
+
+    event = salt.utils.event.get_master_event(opts, opts['sock_dir'], listen=True)
+    try:
+        while True:
+            ret = event.get_event(wait=1, full=True, auto_reconnect=True)
+            yield (ret['tag'], ret['data']) if ret else None
+    finally:
+        event.destroy()
+
+
+def recorded_event_source(path: str):
+    # Replays a recorded stream, one {"tag": ..., "data": ...} JSON object per line.
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                event = json.loads(line)
+                yield event['tag'], event.get('data', {})
+
+
+class EventCollector:
+    def __init__(self, source, publish, classifier, master: str, flush_interval: int = FLUSH_INTERVAL, on_minion_start=None):
+        self.source = source
+        self.publish = publish
+        self.classifier = classifier
+        self.master = master
+        self.flush_interval = flush_interval
+        self.on_minion_start = on_minion_start
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.statuses = {}
+        self.active_jobs = {}
+        self.all_jobs_total = 0
+        self.dirty = False
+        self.ready = False
+        self.last_flush = 0
+
+    def _match(self, fun: str):
+        return self.classifier(fun)
+
+    def reconcile(self, metrics: dict, active_jids=(), active_since: str = ''):
+        # Polled data replaces the streamed state, except for job results that
+        # arrived on the bus while the poll was running and are newer than it.
+        # Jobs started after the active jobs were polled (JID >= active_since)
+        # are kept as well; polled jobs with unknown minions stay active until
+        # the next poll. Returns the polled metrics with the streamed state
+        # written over them.
+        with self.lock:
+            retcodes = {item['minion']: item['value'] for item in metrics.get('salt_minion_job_retcode', [])}
+            failed = {item['minion']: item['value'] for item in metrics.get('salt_minion_job_failed_states', [])}
+            jobs = {}
+            for item in metrics.get('salt_minion_job_duration_seconds', []):
+                jobs[item['minion']] = {
+                    'jid': int(item['jid']),
+                    'fun': item['fun'],
+                    'duration': item['value'],
+                    'retcode': retcodes.get(item['minion']),
+                    'failed': failed.get(item['minion'], 0)
+                }
+            for minion, job in self.jobs.items():
+                if job['jid'] > jobs.get(minion, {}).get('jid', 0):
+                    jobs[minion] = job
+            self.jobs = jobs
+            self.statuses = {item['minion']: item['value'] for item in metrics.get('salt_minion_status', [])}
+            active_jobs = {jid: self.active_jobs.get(jid) for jid in active_jids}
+            for jid, minions in self.active_jobs.items():
+                if active_since and jid >= active_since:
+                    active_jobs[jid] = minions
+            self.active_jobs = active_jobs
+            self.all_jobs_total = metrics.get('salt_all_jobs_total', {}).get('value', 0)
+            self.ready = True
+            return self.snapshot(metrics)
+
+    def handle(self, tag: str, data: dict):
+        parts = tag.split('/')
+        if len(parts) >= 4 and parts[:2] == ['salt', 'job']:
+            jid = parts[2]
+            if not jid.isdigit():
+                return False
+            if parts[3] == 'new':
+                self.active_jobs[jid] = set(data.get('minions') or ())
+                self.all_jobs_total += 1
+                return True
+            if parts[3] == 'ret' and len(parts) >= 5:
+                return self._handle_return(jid, parts[4], data)
+            return False
+        if tag == 'salt/auth':
+            return data.get('act') == 'accept' and self._set_up(data.get('id'))
+        if tag == 'minion_start' or (tag.startswith('salt/minion/') and tag.endswith('/start')):
+            if self.on_minion_start:
+                self.on_minion_start(data.get('id'))
+            return self._set_up(data.get('id'))
+        return False
+
+    def _set_up(self, minion):
+        if not minion or self.statuses.get(minion) == 1:
+            return False
+        self.statuses[minion] = 1
+        return True
+
+    def _handle_return(self, jid: str, minion: str, data: dict):
+        pending = self.active_jobs.get(jid)
+        if pending is not None:
+            pending.discard(minion)
+            if not pending:
+                del self.active_jobs[jid]
+        self._set_up(minion)
+
+        fun = data.get('fun', '')
+        if not self._match(fun) or is_probe(data.get('metadata')):
+            return True
+        if int(jid) < self.jobs.get(minion, {}).get('jid', 0):
+            return True
+        summary = summarize_return(data)
+        self.jobs[minion] = {
+            'jid': int(jid),
+            'fun': fun,
+            'duration': summary['duration'] / 1000,
+            'retcode': summary['retcode'],
+            'failed': summary['failed']
+        }
+        return True
+
+    def snapshot(self, metrics: dict):
+        # Writes the streamed state over a copy of the polled metrics.
+        merged = dict(metrics)
+        merged['salt_minion_job_duration_seconds'] = [
+            DURATION_SAMPLE(self.master, minion, job['jid'], job['fun'], job['duration'])
+            for minion, job in self.jobs.items()
+        ]
+        merged['salt_minion_job_retcode'] = [
+            RETCODE_SAMPLE(self.master, minion, job['fun'], job['retcode'])
+            for minion, job in self.jobs.items()
+        ]
+        merged['salt_minion_job_failed_states'] = [
+            FAILED_STATES_SAMPLE(self.master, minion, job['fun'], job['failed'])
+            for minion, job in self.jobs.items()
+        ]
+        merged['salt_minion_status'] = [STATUS_SAMPLE(minion, value) for minion, value in self.statuses.items()]
+        up = sum(1 for value in self.statuses.values() if value == 1)
+        merged['salt_minions_up_total'] = {'value': up}
+        merged['salt_minions_down_total'] = {'value': len(self.statuses) - up}
+        merged['salt_active_jobs_total'] = {'value': len(self.active_jobs)}
+        merged['salt_all_jobs_total'] = {'value': self.all_jobs_total}
+        return merged
+
+    def flush(self):
+        # Nothing is published until the first poll has been reconciled, so an
+        # early event can't replace the full fleet state with a handful of minions.
+        if not self.dirty or not self.ready:
+            return
+        self.publish(self)
+        self.dirty = False
+        self.last_flush = time.monotonic()
+
+    def run(self):
+        log.info('Event collector started.')
+        for event in self.source:
+            try:
+                with self.lock:
+                    if event:
+                        self.dirty = self.handle(*event) or self.dirty
+                    if self.dirty and time.monotonic() - self.last_flush >= self.flush_interval:
+                        self.flush()
+            except Exception:
+                log.error(f'Something went wrong when trying to handle event: {traceback.format_exc()}')
+        with self.lock:
+            self.flush()
+        log.info('Event collector stopped.')
@@ -0,0 +1,78 @@
+import threading
+import prometheus_client as prom
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from prometheus_client.metrics_core import Metric
+from modules.instrumentation import SERIES_DROPPED
+
+
+class Snapshot:
+    # Immutable result of one update: the metric families and their rendered
+    # exposition text. Scrapes only ever see a whole snapshot.
+    __slots__ = ('families', 'text')
+
+    def __init__(self, families: list):
+        self.families = tuple(families)
+        self.text = prom.generate_latest(self)
+
+    def collect(self):
+        return self.families
+
+
+class SnapshotCollector:
+    # `series_limit` caps the series of every labeled metric; samples past the
+    # limit are left out and counted in salt_exporter_series_dropped.
+    def __init__(self, metrics_info: dict, series_limit: int = 0):
+        self.metrics_info = metrics_info
+        self.series_limit = series_limit
+        self.snapshot = Snapshot([])
+
+    def build(self, counts: dict, extra_families: list = ()):
+        families = []
+        for name, meta in self.metrics_info.items():
+            value = counts.get(name)
+            if value is None:
+                continue
+            family = Metric(name, meta.get('desc', ''), getattr(meta.get('type', prom.Gauge), '_type', 'gauge'))
+            labels = meta.get('labels')
+            if labels:
+                for sample in value:
+                    if sample.get('value') is None:
+                        continue
+                    if self.series_limit and len(family.samples) >= self.series_limit:
+                        SERIES_DROPPED.labels(name).inc()
+                        continue
+                    family.add_sample(name, {label: str(sample.get(label, '')) for label in labels}, sample['value'])
+            elif value.get('value') is not None:
+                family.add_sample(name, {}, value['value'])
+            families.append(family)
+        families.extend(extra_families)
+        return Snapshot(families)
+
+    def update(self, counts: dict, extra_families: list = ()):
+        # The new snapshot is built aside and swapped in with one assignment.
+        self.snapshot = self.build(counts, extra_families)
+
+    def collect(self):
+        return self.snapshot.families
+
+
+def start_metrics_server(port: int, addr: str, collector: SnapshotCollector, registry=prom.REGISTRY):
+    # Serves the cached text of the current snapshot followed by the live
+    # registry (process and exporter self-metrics).
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = collector.snapshot.text + prom.generate_latest(registry)
+            self.send_response(200)
+            self.send_header('Content-Type', prom.CONTENT_TYPE_LATEST)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            return
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, thread
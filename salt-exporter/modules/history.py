@@ -0,0 +1,183 @@
+import threading
+from collections import deque
+from datetime import datetime
+from modules.jobs import build_job_index, jid_before, is_probe
+
+QUANTILES = (0.5, 0.95)
+FUNCTION_WINDOW = 1000
+
+
+def jid_timestamp(jid):
+    return datetime.strptime(str(jid)[:14], '%Y%m%d%H%M%S').timestamp()
+
+
+def is_dry_run(args):
+    # test=True comes as a keyword dict, or as a string on older loads.
+    return any(
+        (isinstance(arg, dict) and str(arg.get('test')).lower() == 'true')
+        or (isinstance(arg, str) and arg.replace(' ', '').lower() == 'test=true')
+        for arg in args or ()
+    )
+
+
+def is_highstate(fun: str, args):
+    # state.apply without an sls to apply runs the highstate, keyword
+    # arguments (test=True, pillar=...) are passed as dicts. Dry runs change
+    # nothing and don't count.
+    if fun == 'state.highstate':
+        return not is_dry_run(args)
+    return (
+        fun == 'state.apply' and args is not None and not is_dry_run(args)
+        and not any(not isinstance(arg, dict) for arg in args)
+    )
+
+
+def is_failed(outcome: tuple):
+    _, _, _, retcode, failed = outcome
+    return bool(failed) or retcode not in (0, None)
+
+
+class MinionHistory:
+    # Ring buffer of (jid, fun, duration, retcode, failed states) outcomes
+    # ordered by JID, with the number of failed ones kept up to date.
+    __slots__ = ('outcomes', 'failures', 'last_highstate')
+
+    def __init__(self, size: int):
+        self.outcomes = deque(maxlen=size)
+        self.failures = 0
+        self.last_highstate = None
+
+    def add(self, outcome: tuple):
+        # Returns False when the outcome is already known or older than
+        # everything a full buffer keeps.
+        outcomes = self.outcomes
+        i = len(outcomes)
+        while i and outcomes[i - 1][0] > outcome[0]:
+            i -= 1
+        if i and outcomes[i - 1][0] == outcome[0]:
+            return False
+        if len(outcomes) == outcomes.maxlen:
+            if i == 0:
+                return False
+            self.failures -= is_failed(outcomes.popleft())
+            i -= 1
+        outcomes.insert(i, outcome)
+        self.failures += is_failed(outcome)
+        return True
+
+
+class JobHistory:
+    # Recent job outcomes of every minion, fed incrementally: each cycle only
+    # the jobs listed since the previous one (and the ones that were still
+    # running then) are fetched, so the work follows the number of new jobs
+    # instead of the day's. Jobs are taken from `overlap` seconds below the
+    # newest JID seen, for the ones listed late; the JIDs already handed out
+    # in that window are remembered so they are not fetched twice. Durations
+    # of the recent jobs of every function are kept in a window of their own
+    # for the quantiles.
+    def __init__(self, size: int = 20, function_window: int = FUNCTION_WINDOW, overlap: int = 60):
+        self.size = max(1, size)
+        self.function_window = function_window
+        self.overlap = overlap
+        self.minions = {}
+        self.functions = {}
+        self.last_jid = None
+        self.waiting = set()
+        self.taken = set()
+        self.lock = threading.Lock()
+
+    def new_jobs(self, job_list: dict, active_jids: set, classifier, resolve=None):
+        # Returns the JIDs to fetch. A cold start only takes the newest
+        # matching job of every minion instead of fetching the whole day;
+        # `resolve` expands the targets the listing does not.
+        with self.lock:
+            if self.last_jid is None:
+                jids = {str(jid) for jid in build_job_index(job_list, classifier, resolve).values()}
+                # The older jobs are skipped for good, not taken next cycle.
+                self.taken = set(job_list)
+            else:
+                since = jid_before(self.last_jid, self.overlap)
+                jids = {
+                    jid for jid, details in job_list.items()
+                    if jid > since and jid not in self.taken and classifier(details.get('Function', ''))
+                    and not is_probe(details.get('Metadata'))
+                }
+                jids.update(jid for jid in self.waiting if jid in job_list)
+            if job_list:
+                self.last_jid = max(self.last_jid or '', max(job_list))
+            self.waiting = jids & active_jids
+            new_jids = jids - self.waiting
+            since = jid_before(self.last_jid, self.overlap) if self.last_jid else ''
+            self.taken = {jid for jid in self.taken | new_jids if jid > since}
+            return sorted(new_jids)
+
+    def record(self, jid, fun: str, args, results: dict):
+        highstate = is_highstate(fun, args)
+        with self.lock:
+            durations = self.functions.get(fun)
+            if durations is None:
+                durations = self.functions[fun] = deque(maxlen=self.function_window)
+            for minion, summary in results.items():
+                if not isinstance(summary, dict) or not summary:
+                    continue
+                outcome = (int(jid), fun, summary.get('duration', 0) / 1000, summary.get('retcode'), summary.get('failed', 0))
+                history = self.minions.get(minion)
+                if history is None:
+                    history = self.minions[minion] = MinionHistory(self.size)
+                if not history.add(outcome):
+                    continue
+                durations.append(outcome[2])
+                if highstate and not is_failed(outcome):
+                    history.last_highstate = max(history.last_highstate or 0, jid_timestamp(jid))
+
+    def retain(self, minions):
+        with self.lock:
+            for minion in self.minions.keys() - set(minions):
+                del self.minions[minion]
+
+    def minion_stats(self):
+        # (minion, latest outcome, failure ratio, last successful highstate)
+        with self.lock:
+            return [
+                (minion, history.outcomes[-1], history.failures / len(history.outcomes), history.last_highstate)
+                for minion, history in self.minions.items() if history.outcomes
+            ]
+
+    def duration_quantiles(self):
+        with self.lock:
+            ret = {}
+            for fun, durations in self.functions.items():
+                if not durations:
+                    continue
+                values = sorted(durations)
+                ret[fun] = {q: values[min(len(values) - 1, int(len(values) * q))] for q in QUANTILES}
+            return ret
+
+    def dump(self):
+        with self.lock:
+            return {
+                'last_jid': self.last_jid,
+                'waiting': list(self.waiting),
+                'taken': list(self.taken),
+                'minions': {
+                    minion: [list(history.outcomes), history.last_highstate]
+                    for minion, history in self.minions.items()
+                },
+                'functions': {fun: list(durations) for fun, durations in self.functions.items()}
+            }
+
+    def load(self, state: dict):
+        with self.lock:
+            self.last_jid = state['last_jid']
+            self.waiting = set(state['waiting'])
+            self.taken = set(state.get('taken', ()))
+            self.minions = {}
+            for minion, (outcomes, last_highstate) in state['minions'].items():
+                history = self.minions[minion] = MinionHistory(self.size)
+                for outcome in outcomes:
+                    history.add(tuple(outcome))
+                history.last_highstate = last_highstate
+            self.functions = {
+                fun: deque(durations, maxlen=self.function_window)
+                for fun, durations in state['functions'].items()
+            }
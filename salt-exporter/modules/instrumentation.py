@@ -0,0 +1,110 @@
+import resource
+import prometheus_client as prom
+
+
+STAGE_DURATION = prom.Histogram(
+    'salt_exporter_stage_duration_seconds',
+    'Duration of exporter collection stages in seconds.',
+    ['stage'],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+)
+CYCLE_DURATION = prom.Histogram(
+    'salt_exporter_cycle_duration_seconds',
+    'Duration of exporter collection cycles in seconds.',
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200)
+)
+LAST_SUCCESS = prom.Gauge(
+    'salt_exporter_last_success_timestamp_seconds',
+    'Unix time of the last successful collection cycle.'
+)
+MINIONS_PROCESSED = prom.Counter(
+    'salt_exporter_minions_processed',
+    'Minions processed by the exporter.'
+)
+RETURNER_CALLS = prom.Counter(
+    'salt_exporter_returner_calls',
+    'Job cache calls made by the exporter.',
+    ['call']
+)
+JOB_QUEUE_DEPTH = prom.Gauge(
+    'salt_exporter_job_queue_depth',
+    'New jobs waiting for a worker of the job processing pool.'
+)
+JOBS_INGESTED = prom.Counter(
+    'salt_exporter_jobs_ingested',
+    'Finished jobs added to the per-minion job history.'
+)
+CYCLE_PEAK_RSS = prom.Gauge(
+    'salt_exporter_cycle_peak_rss_bytes',
+    'Peak resident set size of the exporter during the last collection cycle.'
+)
+PUSH_ATTEMPTS = prom.Counter(
+    'salt_exporter_push_attempts',
+    'Attempts of a slave master to send metrics to the main master.',
+    ['result']
+)
+PUSH_BYTES = prom.Counter(
+    'salt_exporter_push_bytes',
+    'Compressed bytes sent by a slave master to the main master.'
+)
+PUSH_CIRCUIT_STATE = prom.Gauge(
+    'salt_exporter_push_circuit_state',
+    'State of the circuit breaker towards the main master (0 - closed, 1 - half-open, 2 - open).'
+)
+PUSH_SPOOL_DEPTH = prom.Gauge(
+    'salt_exporter_push_spool_depth',
+    'Snapshots waiting in the local spool to be sent to the main master.'
+)
+PUSH_LAST_SUCCESS = prom.Gauge(
+    'salt_exporter_push_last_success_timestamp_seconds',
+    'Unix time of the last snapshot accepted by the main master.'
+)
+RECEIVER_PAYLOADS = prom.Counter(
+    'salt_exporter_receiver_payloads',
+    'Payloads received by the main master from slave masters.',
+    ['result']
+)
+RECEIVER_BATCHES = prom.Counter(
+    'salt_exporter_receiver_batches',
+    'Batches of coalesced received payloads merged by the main master.'
+)
+SERIES_DROPPED = prom.Counter(
+    'salt_exporter_series_dropped',
+    'Series left out of the exposition because the per-metric series limit was reached.',
+    ['metric']
+)
+SNAPSHOT_STALE = prom.Gauge(
+    'salt_exporter_snapshot_stale',
+    'Whether exposed metrics come from the state snapshot of a previous run (1) or a fresh cycle (0).'
+)
+SIGNAL_OVERRUNS = prom.Counter(
+    'salt_exporter_signal_overruns',
+    'Scheduler ticks skipped because the previous run of the signal was still in flight.',
+    ['signal']
+)
+SIGNAL_LAST_SUCCESS = prom.Gauge(
+    'salt_exporter_signal_last_success_timestamp_seconds',
+    'Unix time of the last successful refresh of a signal.',
+    ['signal']
+)
+
+
+def reset_peak_rss():
+    # Resets VmHWM so the next reading is the peak of this cycle only (Linux).
+    try:
+        with open('/proc/self/clear_refs', 'w') as fh:
+            fh.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes():
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
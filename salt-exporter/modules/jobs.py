@@ -0,0 +1,156 @@
+import re
+import fnmatch
+from functools import lru_cache
+from datetime import datetime, timedelta
+from modules.instrumentation import RETURNER_CALLS
+
+GLOB_PATTERN = re.compile(r'^[\w.*?-]+$')
+GLOB_CHARS = re.compile(r'[*?\[]')
+JIDS_FILTER_COUNT = 500
+JIDS_FILTER_MAX_COUNT = 64000
+# Jobs that never describe what a minion was asked to do: the master's own
+# job lookups, and the exporter's probes, published with this metadata.
+BUILTIN_EXCLUDED = frozenset(('saltutil.find_job',))
+PROBE_METADATA = {'salt_exporter': 'probe'}
+
+
+def compile_pattern(pattern: str, option: str):
+    # Patterns are regular expressions matched from the start of the function
+    # name. Salt-style globs such as the old default "*" are not valid regexes
+    # and are translated instead; anything else that does not compile is a
+    # configuration error.
+    pattern = pattern.strip()
+    if not pattern:
+        raise ValueError(f'Empty job function pattern in {option}')
+    try:
+        return re.compile(pattern).pattern
+    except re.error as e:
+        if GLOB_PATTERN.match(pattern):
+            return fnmatch.translate(pattern)
+        raise ValueError(f'Invalid job function pattern {pattern!r} in {option}: {e}') from None
+
+
+def combine_patterns(patterns: list, option: str):
+    sources = [compile_pattern(p, option) for p in patterns]
+    if not sources:
+        return None
+    try:
+        return re.compile('|'.join(f'(?:{p})' for p in sources)).match
+    except re.error:
+        # Global inline flags such as "(?i)" only work at the start of a pattern.
+        compiled = [re.compile(p) for p in sources]
+        return lambda fun: any(p.match(fun) for p in compiled)
+
+
+class FunctionClassifier:
+    # Decides whether jobs of a function are exported: not matched by any
+    # exclude pattern and matched by an include pattern. All patterns are
+    # compiled into one alternation per list and the verdict is memoized per
+    # function name, there are only a few hundred distinct ones.
+    def __init__(self, excluded: list, included: list, cache_size: int = 4096):
+        self.excluded = combine_patterns(excluded, 'exclude_jobs')
+        self.included = combine_patterns(included, 'include_jobs')
+        self.is_included = lru_cache(maxsize=cache_size)(self._classify)
+
+    def _classify(self, fun: str):
+        if fun in BUILTIN_EXCLUDED:
+            return False
+        if self.excluded and self.excluded(fun):
+            return False
+        return bool(self.included and self.included(fun))
+
+    def __call__(self, fun: str):
+        return self.is_included(fun)
+
+
+def is_probe(metadata):
+    return isinstance(metadata, dict) and metadata.get('salt_exporter') == PROBE_METADATA['salt_exporter']
+
+
+def job_targets(details: dict, jid: str = None, resolve=None):
+    # Job listings of the returners (get_jids) carry no "Minions", only the
+    # native local_cache reader adds them. A target that is not a plain
+    # minion id is then expanded by `resolve(jid, details)`, if given.
+    minions = details.get('Minions')
+    if minions:
+        return minions
+    target = details.get('Target')
+    if isinstance(target, (list, tuple)):
+        return target
+    if not isinstance(target, str):
+        return ()
+    literal = details.get('Target-type', 'glob') == 'glob' and not GLOB_CHARS.search(target)
+    if not literal and resolve and 'Minions' not in details:
+        return resolve(jid, details) or ()
+    return (target,)
+
+
+def build_job_index(job_list: dict, classifier: FunctionClassifier, resolve=None):
+    # One pass over the job list: every job is classified by the memoized
+    # classifier and glob/list/compound targets are expanded through the
+    # job's "Minions" field (or `resolve`), so each minion lookup afterwards
+    # is a dict hit.
+    index = {}
+    for job_id, details in job_list.items():
+        if not classifier(details.get('Function', '')) or is_probe(details.get('Metadata')):
+            continue
+        jid = int(job_id)
+        for minion in job_targets(details, job_id, resolve):
+            if jid > index.get(minion, 0):
+                index[minion] = jid
+    return index
+
+
+def summarize_return(job_result: dict):
+    # Reduces a minion return to what the metrics need: the summed per-state
+    # durations in milliseconds, the retcode and the number of failed states.
+    # Returns already summarized by the job cache reader pass through.
+    if 'return' not in job_result and 'duration' in job_result:
+        return job_result
+    summary = {'duration': 0, 'retcode': job_result.get('retcode'), 'failed': 0}
+    job_return = job_result.get('return')
+    if isinstance(job_return, dict):
+        for val in job_return.values():
+            if isinstance(val, dict):
+                duration = val.get('duration', 0)
+                if isinstance(duration, (int, float)):
+                    summary['duration'] += duration
+                if val.get('result') is False:
+                    summary['failed'] += 1
+    return summary
+
+
+def jid_before(jid: str, seconds: float):
+    # The JID `seconds` earlier, or the JID itself when it is not a timestamp.
+    try:
+        return (datetime.strptime(jid[:14], '%Y%m%d%H%M%S') - timedelta(seconds=seconds)).strftime('%Y%m%d%H%M%S') + jid[14:]
+    except ValueError:
+        return jid
+
+
+def list_returner_jobs(returners, returner: str, since: str = None, count: int = JIDS_FILTER_COUNT, filtering: tuple = ()):
+    # Lists the jobs with JIDs from `since` on through the narrowest call the
+    # returner offers:
+    #   get_jids_since(jid) - time-bounded query (custom returners)
+    #   get_jids_filter(count) - the most recent jobs, the count doubles until
+    #                            the oldest returned job reaches `since`; only
+    #                            for the `filtering` returners, local_cache and
+    #                            salt_cache read every job to filter, so each
+    #                            attempt costs a full get_jids
+    #   get_jids() - the whole job cache
+    # The caller still filters by JID, a returner may return more than asked.
+    if since:
+        get_jids_since = returners.get(f'{returner}.get_jids_since')
+        if get_jids_since:
+            RETURNER_CALLS.labels('get_jids_since').inc()
+            return get_jids_since(since)
+        get_jids_filter = returners.get(f'{returner}.get_jids_filter') if returner in filtering else None
+        if get_jids_filter:
+            while count <= JIDS_FILTER_MAX_COUNT:
+                RETURNER_CALLS.labels('get_jids_filter').inc()
+                jobs = get_jids_filter(count, filter_find_job=False)
+                if len(jobs) < count or min(str(job['JID']) for job in jobs) <= since:
+                    return {str(job['JID']): job for job in jobs}
+                count *= 2
+    RETURNER_CALLS.labels('get_jids').inc()
+    return returners[f'{returner}.get_jids']()
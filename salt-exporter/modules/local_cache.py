@@ -0,0 +1,244 @@
+import os
+import logging
+import threading
+import msgpack
+
+log = logging.getLogger(__name__)
+
+JID_FILE = 'jid'
+LOAD_P = '.load.p'
+MINIONS_P = '.minions.p'
+SYNDIC_MINIONS_P = '.minions.{}.p'
+RETURN_P = 'return.p'
+
+
+def _unpacker(fh):
+    return msgpack.Unpacker(fh, raw=False, strict_map_key=False)
+
+
+def _read_map_header(unpacker):
+    try:
+        return unpacker.read_map_header()
+    except ValueError:
+        return None
+
+
+def read_fields(path: str, fields: tuple):
+    # Decodes only the requested keys of a top-level msgpack map and skips the
+    # rest (job arguments, pillar overrides, ...) without building them.
+    ret = {}
+    with open(path, 'rb') as fh:
+        unpacker = _unpacker(fh)
+        size = _read_map_header(unpacker)
+        if size is None:
+            return ret
+        for _ in range(size):
+            key = unpacker.unpack()
+            if key in fields:
+                ret[key] = unpacker.unpack()
+            else:
+                unpacker.skip()
+    return ret
+
+
+def read_return_summary(path: str):
+    # Sums the per-state durations, counts the failed states and reads the
+    # retcode of a stored minion return, without materializing the state
+    # return itself.
+    summary = {'duration': 0, 'retcode': None, 'failed': 0}
+    with open(path, 'rb') as fh:
+        unpacker = _unpacker(fh)
+        size = _read_map_header(unpacker)
+        if size is None:
+            # Old format, return.p holds the bare return data.
+            unpacker.skip()
+            return summary
+        for _ in range(size):
+            key = unpacker.unpack()
+            if key == 'retcode':
+                summary['retcode'] = unpacker.unpack()
+            elif key == 'return':
+                _summarize_states(unpacker, summary)
+            else:
+                unpacker.skip()
+    return summary
+
+
+def _summarize_states(unpacker, summary: dict):
+    states = _read_map_header(unpacker)
+    if states is None:
+        unpacker.skip()
+        return
+    for _ in range(states):
+        unpacker.skip()
+        fields = _read_map_header(unpacker)
+        if fields is None:
+            unpacker.skip()
+            continue
+        for _ in range(fields):
+            key = unpacker.unpack()
+            if key == 'duration':
+                duration = unpacker.unpack()
+                if isinstance(duration, (int, float)):
+                    summary['duration'] += duration
+            elif key == 'result':
+                if unpacker.unpack() is False:
+                    summary['failed'] += 1
+            else:
+                unpacker.skip()
+
+
+class LocalCacheReader:
+    # Reads the local_cache job tree (<jobs>/<hash[:2]>/<hash[2:]>/) directly.
+    # A top-level directory is only listed again when its mtime changes, which
+    # happens when jobs are added to or removed from it, so a refresh costs
+    # one stat() per top-level directory plus the new job directories.
+    def __init__(self, jobs_dir: str):
+        self.jobs_dir = jobs_dir
+        self.top_mtimes = {}
+        self.tops = {}
+        self.jid_dirs = {}
+        self.lock = threading.Lock()
+
+    def dump(self):
+        with self.lock:
+            return {'top_mtimes': dict(self.top_mtimes), 'tops': {top: dict(finals) for top, finals in self.tops.items()}}
+
+    def load(self, state: dict):
+        # Restores the listing state, directories unchanged since are not
+        # listed again.
+        with self.lock:
+            self.top_mtimes = dict(state['top_mtimes'])
+            self.tops = {top: dict(finals) for top, finals in state['tops'].items()}
+            self.jid_dirs = {
+                jid: os.path.join(self.jobs_dir, top, final)
+                for top, finals in self.tops.items() for final, jid in finals.items()
+            }
+
+    def _read_jid(self, job_dir: str):
+        try:
+            with open(os.path.join(job_dir, JID_FILE)) as fh:
+                return fh.read().strip()
+        except OSError:
+            return None
+
+    def _read_minions(self, job_dir: str):
+        # Minions of the job, including the ones syndics reported in
+        # .minions.<syndic>.p, like the local_cache returner's get_load.
+        prefix, suffix = SYNDIC_MINIONS_P.split('{}')
+        try:
+            names = [name for name in os.listdir(job_dir) if name == MINIONS_P or (name.startswith(prefix) and name.endswith(suffix))]
+        except OSError:
+            return set()
+        minions = set()
+        for name in names:
+            try:
+                with open(os.path.join(job_dir, name), 'rb') as fh:
+                    minions.update(_unpacker(fh).unpack() or ())
+            except (OSError, TypeError, ValueError, msgpack.UnpackException):
+                pass
+        return minions
+
+    def _read_job(self, jid: str, job_dir: str):
+        try:
+            load = read_fields(os.path.join(job_dir, LOAD_P), ('fun', 'tgt', 'tgt_type', 'arg', 'metadata', 'kwargs'))
+        except FileNotFoundError:
+            # Salt writes the jid file first, the load follows.
+            return None
+        except (OSError, ValueError, msgpack.UnpackException):
+            log.error(f'Failed to read job {jid} from {job_dir}')
+            return None
+        job = {
+            'Function': load.get('fun', 'unknown-function'),
+            'Target': load.get('tgt', 'unknown-target'),
+            'Target-type': load.get('tgt_type', 'list')
+        }
+        if job['Function'].startswith('state.'):
+            # Arguments of state jobs tell a highstate from an sls run.
+            job['Arguments'] = load.get('arg', [])
+        # The master saves publish keyword arguments, metadata among them,
+        # under "kwargs".
+        kwargs = load.get('kwargs')
+        metadata = load.get('metadata') or (kwargs.get('metadata') if isinstance(kwargs, dict) else None)
+        if metadata:
+            job['Metadata'] = metadata
+        minions = self._read_minions(job_dir)
+        if minions:
+            job['Minions'] = sorted(minions)
+        return job
+
+    def _forget(self, top: str, final: str):
+        self.jid_dirs.pop(self.tops[top].pop(final), None)
+
+    def list_jobs(self, last_jid: str = None, lower: str = None):
+        # Returns the jobs found in directories that appeared since the previous
+        # call, skipping JIDs not newer than last_jid or older than lower.
+        ret = {}
+        with self.lock:
+            try:
+                tops = set(os.listdir(self.jobs_dir))
+            except OSError:
+                return ret
+            for top in set(self.tops) - tops:
+                for final in list(self.tops[top]):
+                    self._forget(top, final)
+                del self.tops[top]
+                self.top_mtimes.pop(top, None)
+            for top in tops:
+                top_path = os.path.join(self.jobs_dir, top)
+                try:
+                    mtime = os.stat(top_path).st_mtime_ns
+                except OSError:
+                    continue
+                if self.top_mtimes.get(top) == mtime:
+                    continue
+                self.top_mtimes[top] = mtime
+                try:
+                    finals = set(os.listdir(top_path))
+                except OSError:
+                    continue
+                known = self.tops.setdefault(top, {})
+                for final in set(known) - finals:
+                    self._forget(top, final)
+                for final in finals - set(known):
+                    job_dir = os.path.join(top_path, final)
+                    jid = self._read_jid(job_dir)
+                    if not jid:
+                        # Directory is still being written, list it again next time.
+                        self.top_mtimes.pop(top, None)
+                        continue
+                    if not ((last_jid and jid <= last_jid) or (lower and jid < lower)):
+                        job = self._read_job(jid, job_dir)
+                        if job is None:
+                            # The load is not written yet, list it again next time.
+                            self.top_mtimes.pop(top, None)
+                            continue
+                        ret[jid] = job
+                    known[final] = jid
+                    self.jid_dirs[jid] = job_dir
+        return ret
+
+    def get_job(self, jid: str, job_dir: str = None):
+        # Same shape as the generic print_job output, but every minion result
+        # only carries the summary of its return.
+        job_dir = job_dir or self.jid_dirs.get(jid)
+        if not job_dir:
+            return None
+        job = self._read_job(jid, job_dir)
+        if job is None:
+            return None
+        result = {}
+        try:
+            minions = os.listdir(job_dir)
+        except OSError:
+            minions = []
+        for minion in minions:
+            path = os.path.join(job_dir, minion, RETURN_P)
+            if minion.startswith('.') or not os.path.isfile(path):
+                continue
+            try:
+                result[minion] = read_return_summary(path)
+            except (OSError, ValueError, msgpack.UnpackException):
+                log.error(f'Failed to read return of {minion} for job {jid}')
+        job['Result'] = result
+        return job
@@ -0,0 +1,187 @@
+import gzip
+import json
+import time
+import requests
+from collections import deque
+from modules.samples import plain
+from modules.instrumentation import PUSH_ATTEMPTS, PUSH_BYTES, PUSH_CIRCUIT_STATE, PUSH_SPOOL_DEPTH, PUSH_LAST_SUCCESS
+
+PROTOCOL_VERSION = '1'
+
+
+def sample_key(sample: dict, labels: tuple):
+    return tuple(str(sample.get(label, '')) for label in labels)
+
+
+def is_full(headers: dict):
+    # Payloads without protocol headers come from older slaves and are full.
+    return headers.get('x-push-full', '1') != '0'
+
+
+def decode_body(headers: dict, body: bytes):
+    if headers.get('content-encoding') == 'gzip':
+        body = gzip.decompress(body)
+    return json.loads(body)
+
+
+class SequenceTracker:
+    # Receiver side of the push protocol. A delta is only accepted when it is
+    # based on the last payload accepted from the same sender process (same
+    # epoch), otherwise the sender is asked for a full resync.
+    def __init__(self):
+        self.sequences = {}
+
+    def check(self, source: str, headers: dict):
+        if 'x-push-seq' not in headers or is_full(headers):
+            return True
+        return self.sequences.get(source) == (headers.get('x-push-epoch'), headers.get('x-push-base'))
+
+    def forget(self, source: str):
+        # The next delta of the source is refused and it resyncs in full.
+        self.sequences.pop(source, None)
+
+    def commit(self, source: str, headers: dict):
+        if 'x-push-seq' in headers:
+            self.sequences[source] = (headers.get('x-push-epoch'), headers['x-push-seq'])
+
+
+class CircuitBreaker:
+    # Closed: every send goes out. After `threshold` consecutive failures the
+    # breaker opens and sends are skipped until the backoff (doubling up to
+    # `max_delay`) expires; the next send is then a single half-open probe
+    # that either closes the breaker or reopens it with a longer backoff.
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, threshold: int = 2, base_delay: float = 5, max_delay: float = 300):
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.state = self.CLOSED
+        self.failures = 0
+        self.retry_at = 0
+
+    def allow(self, now: float = None):
+        now = time.monotonic() if now is None else now
+        if self.state == self.OPEN and now >= self.retry_at:
+            self.state = self.HALF_OPEN
+        return self.state != self.OPEN
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.retry_at = 0
+
+    def record_failure(self, now: float = None):
+        now = time.monotonic() if now is None else now
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            delay = min(self.max_delay, self.base_delay * 2 ** max(0, self.failures - self.threshold))
+            self.state = self.OPEN
+            self.retry_at = now + delay
+
+    def retry_in(self, now: float = None):
+        now = time.monotonic() if now is None else now
+        return max(0, self.retry_at - now) if self.state == self.OPEN else 0
+
+
+class PushClient:
+    # Sender side: keeps the last acknowledged snapshot and sends only the
+    # samples added, changed or removed since then, gzip-compressed over a
+    # keep-alive session. Every `full_every` deltas, and whenever the
+    # receiver reports a gap (409), the full snapshot is sent instead.
+    def __init__(self, url: str, metrics_info: dict, headers: dict, full_every: int = 12, timeout: int = 10,
+                 spool_size: int = 3, breaker: CircuitBreaker = None):
+        self.url = url
+        self.headers = headers
+        self.full_every = full_every
+        self.timeout = timeout
+        self.labels = {name: tuple(meta['labels']) for name, meta in metrics_info.items() if meta.get('labels')}
+        self.session = requests.Session()
+        self.epoch = str(time.time_ns())
+        self.seq = 0
+        self.acked_seq = 0
+        self.acked = None
+        self.deltas_since_full = 0
+        self.bytes_sent = 0
+        self.spool = deque(maxlen=max(1, spool_size))
+        self.breaker = breaker or CircuitBreaker()
+
+    def _samples(self, counts: dict):
+        return {
+            name: {sample_key(sample, labels): sample for sample in counts.get(name, [])}
+            for name, labels in self.labels.items()
+        }
+
+    def _delta(self, counts: dict, samples: dict):
+        upsert = {}
+        remove = {}
+        for name, current in samples.items():
+            acked = self.acked.get(name, {})
+            changed = [sample for key, sample in current.items() if key not in acked or acked[key] != sample]
+            removed = [list(key) for key in acked.keys() - current.keys()]
+            if changed:
+                upsert[name] = changed
+            if removed:
+                remove[name] = removed
+        counters = {name: value for name, value in counts.items() if name not in self.labels}
+        return {'counters': counters, 'upsert': upsert, 'remove': remove}
+
+    def _send(self, counts: dict, samples: dict, full: bool):
+        self.seq += 1
+        body = gzip.compress(json.dumps(counts if full else self._delta(counts, samples), default=plain).encode())
+        headers = dict(self.headers)
+        headers.update({
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip',
+            'X-Push-Version': PROTOCOL_VERSION,
+            'X-Push-Epoch': self.epoch,
+            'X-Push-Seq': str(self.seq),
+            'X-Push-Base': str(self.acked_seq),
+            'X-Push-Full': '1' if full else '0'
+        })
+        response = self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+        self.bytes_sent += len(body)
+        PUSH_BYTES.inc(len(body))
+        if response.status_code in (200, 202):
+            self.acked = samples
+            self.acked_seq = self.seq
+            self.deltas_since_full = 0 if full else self.deltas_since_full + 1
+        return response
+
+    def push(self, counts: dict):
+        samples = self._samples(counts)
+        full = self.acked is None or self.deltas_since_full >= self.full_every
+        response = self._send(counts, samples, full)
+        if response.status_code == 409 and not full:
+            response = self._send(counts, samples, True)
+        return response
+
+    def submit(self, counts: dict):
+        # Spools the snapshot and sends the newest spooled one if the breaker
+        # allows it. Returns the response, or None when nothing was sent.
+        self.spool.append(counts)
+        PUSH_SPOOL_DEPTH.set(len(self.spool))
+        return self.flush()
+
+    def flush(self):
+        if not self.spool:
+            return None
+        if not self.breaker.allow():
+            PUSH_ATTEMPTS.labels('skipped').inc()
+            return None
+        try:
+            response = self.push(self.spool[-1])
+        except requests.RequestException:
+            response = None
+        if response is not None and response.status_code in (200, 202):
+            # Older spooled snapshots are superseded by the one just sent.
+            self.spool.clear()
+            self.breaker.record_success()
+            PUSH_ATTEMPTS.labels('success').inc()
+            PUSH_LAST_SUCCESS.set_to_current_time()
+        else:
+            self.breaker.record_failure()
+            PUSH_ATTEMPTS.labels('failure').inc()
+        PUSH_SPOOL_DEPTH.set(len(self.spool))
+        PUSH_CIRCUIT_STATE.set(self.breaker.state)
+        return response
@@ -0,0 +1,163 @@
+import json
+import time
+import asyncio
+import logging
+import traceback
+from modules.instrumentation import RECEIVER_PAYLOADS, RECEIVER_BATCHES
+
+log = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 256 * 1024 * 1024
+READ_TIMEOUT = 30
+REASONS = {
+    200: 'OK',
+    202: 'Accepted',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    408: 'Request Timeout',
+    409: 'Conflict',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    503: 'Service Unavailable'
+}
+
+
+def payload_source(headers: dict):
+    return headers.get('x-salt-master') or headers.get('user-agent', 'unknown')
+
+
+class AsyncReceiver:
+    # Minimal asyncio HTTP/1.1 receiver for slave master payloads. A POST is
+    # only queued and answered with 202 right away; when the queue is full the
+    # sender gets 503 and retries on its next cycle. A single worker drains
+    # the queue, keeps the newest payload per source within the coalesce
+    # window and hands the batch to `apply` in a worker thread, so a burst of
+    # POSTs costs one merge and one re-render. Every read is bounded by
+    # `read_timeout`, so idle or stalled connections don't pile up.
+    def __init__(self, apply, queue_size: int = 64, coalesce_window: float = 1.0, sequences=None,
+                 read_timeout: float = READ_TIMEOUT):
+        self.apply = apply
+        self.sequences = sequences
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.coalesce_window = coalesce_window
+        self.read_timeout = read_timeout
+
+    async def _read(self, read):
+        return await asyncio.wait_for(read, self.read_timeout)
+
+    async def _respond(self, writer, status: int, payload: dict, keep_alive: bool, headers: dict = None):
+        body = json.dumps(payload).encode()
+        lines = [
+            f'HTTP/1.1 {status} {REASONS.get(status, "")}',
+            'Content-Type: application/json',
+            f'Content-Length: {len(body)}',
+            f'Connection: {"keep-alive" if keep_alive else "close"}'
+        ]
+        lines.extend(f'{k}: {v}' for k, v in (headers or {}).items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        await writer.drain()
+
+    async def _read_request(self, reader):
+        # Headers and body of a request; the body is None when it is too large.
+        headers = {}
+        while True:
+            line = await self._read(reader.readline())
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = headers.get('content-length')
+        if length is None:
+            return headers, b''
+        if not length.isdigit() or int(length) > MAX_BODY_SIZE:
+            return headers, None
+        return headers, await self._read(reader.readexactly(int(length)))
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await self._read(reader.readline())
+                except asyncio.TimeoutError:
+                    # Idle keep-alive connection.
+                    break
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'Malformed request line'}, False)
+                    break
+                try:
+                    headers, body = await self._read_request(reader)
+                except asyncio.TimeoutError:
+                    RECEIVER_PAYLOADS.labels('timeout').inc()
+                    await self._respond(writer, 408, {'error': 'Request timeout'}, False)
+                    break
+                if body is None:
+                    await self._respond(writer, 413, {'error': 'Payload too large'}, False)
+                    break
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                length = headers.get('content-length')
+
+                if path != '/':
+                    await self._respond(writer, 404, {'error': 'Not found'}, keep_alive)
+                elif method != 'POST':
+                    await self._respond(writer, 405, {'error': 'Only POST is supported'}, keep_alive)
+                elif length is None:
+                    await self._respond(writer, 411, {'error': 'Content-Length required'}, False)
+                    break
+                elif not body:
+                    await self._respond(writer, 400, {'error': 'No JSON received'}, keep_alive)
+                elif self.sequences and not self.sequences.check(payload_source(headers), headers):
+                    RECEIVER_PAYLOADS.labels('gap').inc()
+                    await self._respond(writer, 409, {'error': 'Sequence gap, full resync required'}, keep_alive)
+                else:
+                    try:
+                        self.queue.put_nowait((headers, body, time.monotonic()))
+                        if self.sequences:
+                            self.sequences.commit(payload_source(headers), headers)
+                        RECEIVER_PAYLOADS.labels('queued').inc()
+                        await self._respond(writer, 202, {'success': 'Data queued'}, keep_alive)
+                    except asyncio.QueueFull:
+                        RECEIVER_PAYLOADS.labels('busy').inc()
+                        await self._respond(writer, 503, {'error': 'Receiver is busy'}, keep_alive, {'Retry-After': '5'})
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            log.error(f'Something went wrong when trying to handle request: {traceback.format_exc()}')
+        finally:
+            writer.close()
+
+    async def merge_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.coalesce_window
+            while True:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            RECEIVER_BATCHES.inc()
+            try:
+                await loop.run_in_executor(None, self.apply, batch)
+            except Exception:
+                log.error(f'Something went wrong when trying to merge received data: {traceback.format_exc()}')
+            for _ in batch:
+                self.queue.task_done()
+
+    async def serve(self, addr: str, port: int):
+        server = await asyncio.start_server(self.handle_connection, addr, port)
+        worker = asyncio.create_task(self.merge_worker())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            worker.cancel()
@@ -1,12 +1,14 @@
-import salt.key
-import salt.runner
-import salt.minion
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
 import salt.version
-from salt.config import master_config as mast_conf, minion_config as min_conf
-from salt.utils.jid import jid_to_time
-from salt.client import get_local_client
-from salt.loader import grains as grns, minion_mods, utils as utls
-from salt.pillar import get_pillar
+from salt.config import master_config as mast_conf
+from salt.utils.jid import jid_to_time, jid_dir
+from env import EXPORTER_JOB_CACHE_SIZE, EXPORTER_NATIVE_JOB_CACHE, EXPORTER_RETURN_FETCHES, EXPORTER_JIDS_FILTER_RETURNERS, EXPORTER_JID_OVERLAP
+from modules.local_cache import LocalCacheReader
+from modules.jobs import list_returner_jobs, summarize_return, jid_before
+from modules.instrumentation import RETURNER_CALLS
 
 try:
     from dateutil.parser import parse as du_parse
@@ -16,17 +18,75 @@ except ImportError:
     DATEUTIL_SUPPORT = False
 
 master_config = mast_conf('/etc/salt/master')
-minion_config = min_conf('/etc/salt/minion')
-grains = grns(master_config)
-master_config['grains'] = grains
-pillars = get_pillar(master_config, grains, minion_config['id'], 'base').compile_pillar()
-utils = utls(master_config)
-modules = minion_mods(master_config, utils=utils)
-salt_runner = salt.runner.RunnerClient(master_config)
-salt_client = get_local_client(master_config["conf_file"])
-salt_key = salt.key.Key(master_config)
-mminion = salt.minion.MasterMinion(master_config)
 master_version = salt.version.__saltstack_version__.string
+local_cache_reader = LocalCacheReader(os.path.join(master_config['cachedir'], 'jobs')) if EXPORTER_NATIVE_JOB_CACHE else None
+_local = threading.local()
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _lazy_client(name, factory):
+    # Salt clients are built on first use only: importing this module must not
+    # render grains or pillar or set up loaders the exporter never calls.
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def _create_runner():
+    import salt.runner
+    return salt.runner.RunnerClient(master_config)
+
+
+def _create_key():
+    import salt.key
+    return salt.key.Key(master_config)
+
+
+def _create_returners():
+    # Only the returner loader: MasterMinion would also render grains and set
+    # up execution modules, states and renderers. The execution module loader
+    # is lazy, modules are only imported when a returner calls one of them.
+    import salt.loader
+    utils = salt.loader.utils(master_config)
+    functions = salt.loader.minion_mods(master_config, utils=utils)
+    return salt.loader.returners(master_config, functions)
+
+
+def get_salt_runner():
+    return _lazy_client('runner', _create_runner)
+
+
+def get_salt_key():
+    return _lazy_client('key', _create_key)
+
+
+def get_returners():
+    return _lazy_client('returners', _create_returners)
+
+
+def override_clients(runner=None, key=None, returners=None, local_client=None):
+    # Replaces the salt clients with stand-ins, for benchmarks and tools that
+    # run without a master. A given local client is shared by all threads.
+    for name, client in (('runner', runner), ('key', key), ('returners', returners), ('local', local_client)):
+        if client is not None:
+            _clients[name] = client
+
+
+def get_salt_client():
+    # LocalClient waits for returns on its own event listener, so concurrent
+    # broadcasts from different threads each need their own client.
+    if 'local' in _clients:
+        return _clients['local']
+    client = getattr(_local, 'salt_client', None)
+    if client is None:
+        from salt.client import get_local_client
+        client = _local.salt_client = get_local_client(master_config["conf_file"])
+    return client
 
 
 def _get_returner(returner_types):
@@ -64,7 +124,90 @@ def _format_jid_instance(jid, job):
     return ret
 
 
-def salt_print_job(jid):
+class JobCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.jobs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, jid):
+        with self.lock:
+            job = self.jobs.get(jid)
+            if job is None:
+                self.misses += 1
+                return None
+            self.jobs.move_to_end(jid)
+            self.hits += 1
+            return job
+
+    def put(self, jid, job):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.jobs[jid] = job
+            self.jobs.move_to_end(jid)
+            while len(self.jobs) > self.maxsize:
+                self.jobs.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.jobs.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def dump(self):
+        with self.lock:
+            return list(self.jobs.items())
+
+    def load(self, jobs: list):
+        with self.lock:
+            self.jobs = OrderedDict(jobs[-self.maxsize:] if self.maxsize > 0 else [])
+
+
+job_cache = JobCache(EXPORTER_JOB_CACHE_SIZE)
+_return_fetches = threading.BoundedSemaphore(max(1, EXPORTER_RETURN_FETCHES))
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def salt_print_job(jid, active_jids=None):
+    # Finished jobs never change, so with the set of active JIDs known their
+    # results are served from the cache. Without it every call goes to the
+    # returner, as before. Concurrent lookups of the same job (a highstate of
+    # the whole fleet is the last job of every minion) share one fetch.
+    cacheable = active_jids is not None and str(jid) not in active_jids
+    if not cacheable:
+        return _fetch_job(jid, False)
+    cached = job_cache.get(str(jid))
+    if cached is not None:
+        return cached
+
+    with _inflight_lock:
+        flight = _inflight.get(str(jid))
+        owner = flight is None
+        if owner:
+            flight = _inflight[str(jid)] = Future()
+    if not owner:
+        return flight.result()
+    try:
+        ret = _fetch_job(jid, True)
+        flight.set_result(ret)
+        return ret
+    except BaseException as e:
+        flight.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[str(jid)]
+
+
+def _fetch_job(jid, cacheable):
+    # Minion returns are reduced to their summaries as soon as they arrive.
+    # The native reader decodes one minion return at a time; a returner's
+    # get_jid hands over every minion's full return of the job at once, so
+    # at most `return_fetches` of those are held at the same time.
     ret = {}
     returner = _get_returner((
         master_config.get("ext_job_cache"),
@@ -72,11 +215,22 @@ def salt_print_job(jid):
         master_config.get("master_job_cache")
     ))
 
+    if returner == "local_cache" and local_cache_reader:
+        RETURNER_CALLS.labels('native_get_job').inc()
+        job = local_cache_reader.get_job(str(jid), jid_dir(jid, local_cache_reader.jobs_dir, master_config["hash_type"]))
+        if job is not None:
+            job["StartTime"] = jid_to_time(jid)
+            ret[jid] = job
+            if cacheable:
+                job_cache.put(str(jid), ret)
+            return ret
+
     try:
-        get_load_func = mminion.returners.get(f"{returner}.get_load")
+        get_load_func = get_returners().get(f"{returner}.get_load")
         if not get_load_func:
             raise TypeError(f"Returner '{returner}.get_load' is not available.")
 
+        RETURNER_CALLS.labels('get_load').inc()
         job = get_load_func(jid)
         ret[jid] = _format_jid_instance(jid, job)
 
@@ -86,51 +240,139 @@ def salt_print_job(jid):
             f"retrieved. Check master log for details."
         )}}
 
-    get_jid_func = mminion.returners.get(f"{returner}.get_jid")
+    get_jid_func = get_returners().get(f"{returner}.get_jid")
     if get_jid_func:
-        ret[jid]["Result"] = get_jid_func(jid)
+        RETURNER_CALLS.labels('get_jid').inc()
+        with _return_fetches:
+            ret[jid]["Result"] = {
+                minion: summarize_return(result)
+                for minion, result in get_jid_func(jid).items()
+                if isinstance(result, dict)
+            }
     else:
         ret[jid]["Result"] = None
 
     if master_config.get("job_cache_store_endtime"):
-        get_endtime_func = mminion.returners.get(f"{master_config['master_job_cache']}.get_endtime")
+        get_endtime_func = get_returners().get(f"{master_config['master_job_cache']}.get_endtime")
         if get_endtime_func:
+            RETURNER_CALLS.labels('get_endtime').inc()
             endtime = get_endtime_func(jid)
             if endtime:
                 ret[jid]["EndTime"] = endtime
 
+    if cacheable:
+        job_cache.put(str(jid), ret)
     return ret
 
 
+def _to_jid(value, fill):
+    # JIDs are "%Y%m%d%H%M%S%f" timestamps, so a time bound turns into a JID
+    # prefix that can be compared against JIDs as plain strings.
+    if not value:
+        return None
+    if isinstance(value, str):
+        if not DATEUTIL_SUPPORT:
+            return None
+        value = du_parse(value)
+    return value.strftime("%Y%m%d%H%M%S") + fill
+
+
+class JidCache:
+    # Jobs are listed incrementally from the newest JID seen minus an overlap
+    # window: a job whose load is saved late, or a JID generated on a master
+    # with a clock behind, is older than jobs already listed and would be
+    # missed by a strict cutoff. Jobs listed twice are deduplicated by JID.
+    def __init__(self, overlap: int = EXPORTER_JID_OVERLAP):
+        self.jobs = {}
+        self.last_jid = None
+        self.overlap = overlap
+        self.lock = threading.Lock()
+
+    def refresh(self, lower, upper, loader):
+        with self.lock:
+            since = self.last_jid and jid_before(self.last_jid, self.overlap)
+            for jid, job in loader(since, lower).items():
+                jid = str(jid)
+                if since and jid <= since:
+                    continue
+                if lower and jid < lower:
+                    continue
+                self.jobs[jid] = job
+                if not self.last_jid or jid > self.last_jid:
+                    self.last_jid = jid
+
+            if lower:
+                for jid in [jid for jid in self.jobs if jid < lower]:
+                    del self.jobs[jid]
+
+            return {
+                jid: job for jid, job in self.jobs.items()
+                if not upper or jid <= upper
+            }
+
+    def clear(self):
+        with self.lock:
+            self.jobs.clear()
+            self.last_jid = None
+
+    def dump(self):
+        with self.lock:
+            return {'jobs': dict(self.jobs), 'last_jid': self.last_jid}
+
+    def load(self, state: dict):
+        with self.lock:
+            self.jobs = dict(state['jobs'])
+            self.last_jid = state['last_jid']
+
+
+jid_cache = JidCache()
+
+
+def _load_jids(returner, last_jid, lower):
+    if returner == "local_cache" and local_cache_reader:
+        RETURNER_CALLS.labels('native_list_jobs').inc()
+        return local_cache_reader.list_jobs(last_jid, lower)
+    return list_returner_jobs(get_returners(), returner, last_jid or lower, filtering=EXPORTER_JIDS_FILTER_RETURNERS)
+
+
 def salt_list_jobs(start_time, end_time):
     returner = _get_returner(
         (master_config["ext_job_cache"], None, master_config["master_job_cache"])
     )
 
-    ret = mminion.returners[f"{returner}.get_jids"]()
-
-    mret = {}
-    for item in ret:
-        _match = True
-
-        if start_time and _match:
-            _match = False
-            if DATEUTIL_SUPPORT:
-                _parsed_start_time = du_parse(start_time)
-                _start_time = du_parse(ret[item]["StartTime"])
-                if _start_time >= _parsed_start_time:
-                    _match = True
-
-        if end_time and _match:
-            _match = False
-            if DATEUTIL_SUPPORT:
-                _parsed_end_time  = du_parse(end_time)
-                _start_time = du_parse(ret[item]["StartTime"])
-                if _start_time <= _parsed_end_time :
-                    _match = True
-
-        if _match:
-            mret[item] = ret[item]
-    
-    del ret, returner
-    return mret
+    return jid_cache.refresh(
+        _to_jid(start_time, "000000"),
+        _to_jid(end_time, "999999"),
+        lambda last_jid, lower: _load_jids(returner, last_jid, lower)
+    )
+
+
+def salt_job_minions(jid, details: dict):
+    # Minions a glob or compound job was sent to, from its load. Stored in the
+    # listed job, which the JID cache keeps, so every job is loaded once.
+    returner = _get_returner(
+        (master_config["ext_job_cache"], None, master_config["master_job_cache"])
+    )
+    RETURNER_CALLS.labels('get_load').inc()
+    minions = (get_returners()[f"{returner}.get_load"](str(jid)) or {}).get("Minions") or []
+    details["Minions"] = list(minions)
+    return minions
+
+
+def dump_caches():
+    caches = {'job_cache': job_cache.dump(), 'jid_cache': jid_cache.dump()}
+    if local_cache_reader:
+        caches['local_cache'] = local_cache_reader.dump()
+    return caches
+
+
+def load_caches(caches: dict):
+    # The JID cache and the native reader listing go together: the reader only
+    # returns jobs it has not listed before, which the JID cache must hold.
+    if local_cache_reader and 'local_cache' not in caches:
+        caches = {'job_cache': caches['job_cache']}
+    job_cache.load(caches['job_cache'])
+    if 'jid_cache' in caches:
+        jid_cache.load(caches['jid_cache'])
+    if local_cache_reader and 'local_cache' in caches:
+        local_cache_reader.load(caches['local_cache'])
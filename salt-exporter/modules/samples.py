@@ -0,0 +1,84 @@
+import sys
+
+
+class Sample:
+    # Base of the per-label-set sample records. A record holds its label
+    # values and value in slots instead of a per-sample dict, with label
+    # strings interned so a minion name is stored once across all metrics and
+    # cycles. Records read like the dicts they replace (`get`, `[]`, `keys`),
+    # so consumers need not care which one they got.
+    __slots__ = ()
+    fields = ()
+
+    def __init__(self, *args, **kwargs):
+        for field, value in zip(self.fields, args):
+            object.__setattr__(self, field, sys.intern(value) if type(value) is str else value)
+        for field in self.fields[len(args):]:
+            value = kwargs.get(field)
+            object.__setattr__(self, field, sys.intern(value) if type(value) is str else value)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default) if key in self.fields else default
+
+    def __getitem__(self, key: str):
+        if key not in self.fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key: str):
+        return key in self.fields
+
+    def keys(self):
+        return self.fields
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self.fields]
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.fields}
+
+    def __eq__(self, other):
+        if isinstance(other, Sample):
+            return self.fields == other.fields and all(getattr(self, f) == getattr(other, f) for f in self.fields)
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.as_dict()!r})'
+
+
+_sample_types = {}
+
+
+def sample_type(labels):
+    # One record class per label set, shared by every metric using it.
+    labels = tuple(labels)
+    cls = _sample_types.get(labels)
+    if cls is None:
+        fields = labels + ('value',)
+        cls = _sample_types[labels] = type(
+            f'Sample_{"_".join(labels)}', (Sample,), {'__slots__': fields, 'fields': fields}
+        )
+    return cls
+
+
+def sample_types(metrics_info: dict):
+    return {name: sample_type(meta['labels']) for name, meta in metrics_info.items() if meta.get('labels')}
+
+
+def compact(counts: dict, types: dict):
+    # Converts the labeled samples of decoded payloads (plain dicts) to records.
+    return {
+        name: [types[name](**sample) for sample in value] if name in types and isinstance(value, list) else value
+        for name, value in counts.items()
+    }
+
+
+def plain(obj):
+    # `default` hook for json/msgpack encoders.
+    if isinstance(obj, Sample):
+        return obj.as_dict()
+    return str(obj)
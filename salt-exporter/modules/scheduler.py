@@ -0,0 +1,86 @@
+import time
+import random
+import logging
+import traceback
+from modules.instrumentation import STAGE_DURATION, SIGNAL_OVERRUNS, SIGNAL_LAST_SUCCESS
+
+log = logging.getLogger(__name__)
+
+
+class Signal:
+    __slots__ = ('name', 'func', 'interval', 'jitter', 'result_key', 'next_run', 'future')
+
+    def __init__(self, name: str, func, interval: float, jitter: float, result_key: str):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.result_key = result_key
+        self.next_run = 0
+        self.future = None
+
+    def reschedule(self, now: float):
+        spread = self.interval * self.jitter
+        self.next_run = now + self.interval + random.uniform(-spread, spread)
+
+
+class TieredScheduler:
+    # Refreshes every signal on its own interval (with jitter, so broadcasts
+    # of several exporters don't line up) on a shared executor. A signal that
+    # is due while its previous run is still in flight skips its interval and
+    # counts an overrun. One sharing its result key with another signal in
+    # flight (both would write the same result) waits and is retried every
+    # tick until that one finishes. Finished results are kept per result key
+    # and handed to `on_complete` after every tick in which at least one
+    # signal finished; a failed run keeps the previous result.
+    def __init__(self, executor, on_complete, tick: float = 0.5):
+        self.executor = executor
+        self.on_complete = on_complete
+        self.tick = tick
+        self.signals = []
+        self.results = {}
+
+    def add(self, name: str, func, interval: float, jitter: float = 0.1, result_key: str = None, delay: float = 0):
+        signal = Signal(name, func, interval, jitter, result_key or name)
+        signal.next_run = time.monotonic() + delay
+        self.signals.append(signal)
+
+    def _timed(self, signal: Signal):
+        with STAGE_DURATION.labels(signal.name).time():
+            return signal.func()
+
+    def run_pending(self, now: float = None):
+        now = time.monotonic() if now is None else now
+        completed = []
+        for signal in self.signals:
+            future = signal.future
+            if future is not None and future.done():
+                signal.future = None
+                try:
+                    self.results[signal.result_key] = future.result()
+                    SIGNAL_LAST_SUCCESS.labels(signal.name).set_to_current_time()
+                    completed.append(signal.name)
+                except Exception:
+                    log.error(f'Signal {signal.name} failed, keeping its last result: {traceback.format_exc()}')
+            if now < signal.next_run:
+                continue
+            if signal.future is not None:
+                signal.reschedule(now)
+                SIGNAL_OVERRUNS.labels(signal.name).inc()
+                log.warning(f'Signal {signal.name} is still in flight, tick skipped.')
+                continue
+            if any(other.future is not None for other in self.signals if other.result_key == signal.result_key):
+                continue
+            signal.reschedule(now)
+            signal.future = self.executor.submit(self._timed, signal)
+        return completed
+
+    def run(self):
+        while True:
+            completed = self.run_pending()
+            if completed:
+                try:
+                    self.on_complete(completed)
+                except Exception:
+                    log.error(f'Something went wrong when trying to handle refreshed signals: {traceback.format_exc()}')
+            time.sleep(self.tick)
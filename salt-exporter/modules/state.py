@@ -0,0 +1,45 @@
+import os
+import time
+import logging
+import msgpack
+from modules.samples import plain
+
+log = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+
+
+def save_state(path: str, state: dict):
+    # Written to a temporary file next to the target and renamed over it, so
+    # a crash mid-write never leaves a truncated snapshot behind.
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    body = msgpack.packb({'version': STATE_VERSION, 'saved': time.time(), 'state': state}, use_bin_type=True, default=plain)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as fh:
+            fh.write(body)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return len(body)
+
+
+def load_state(path: str):
+    # Returns (state, saved timestamp), or (None, None) when there is no
+    # usable snapshot.
+    try:
+        with open(path, 'rb') as fh:
+            data = msgpack.unpackb(fh.read(), raw=False, strict_map_key=False)
+    except FileNotFoundError:
+        return None, None
+    except (OSError, ValueError, msgpack.UnpackException):
+        log.error(f'Failed to read state snapshot {path}, starting cold')
+        return None, None
+    if not isinstance(data, dict) or data.get('version') != STATE_VERSION:
+        log.error(f'Unsupported state snapshot {path}, starting cold')
+        return None, None
+    return data['state'], data['saved']